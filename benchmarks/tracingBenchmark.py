@@ -0,0 +1,72 @@
+"""
+The accuracy and the cost of the engines of `qshpost._tracing.traceLine` on a model field with one island chain,
+    B^s = eps * sin(theta - nfp*zeta) * (1 - s^2), B^theta = iota(s) = 2 + 0.5*s, B^zeta = 1,
+whose m = 1, n = nfp island is at s = 0. The lines start on the section zeta = 0 across the island, and their section points
+are compared with the reference (DOP853, `substep=4`). The samplers of `qshpost._integrate` are run as `_iterLines` runs them:
+one line at a time for the default engine, and all the lines as one system for `batch=True` and the fixed-step engine.
+Run it as
+    python benchmarks/tracingBenchmark.py [--niter 200] [--lines 16] [--nstep 32]
+"""
+import argparse
+import time
+import numpy as np
+from qshpost._integrate import restartSamples, continuousSamples, fixedStepSamples, instrumentFun, TracingStats
+
+
+nfp = 2
+eps = 0.01
+
+
+def getB_many(zeta, state):
+    sValue, thetaValue = state[0::2], state[1::2]
+    dState = np.empty_like(state)
+    dState[0::2] = eps * np.sin(thetaValue - nfp*zeta) * (1 - sValue*sValue)
+    dState[1::2] = 2 + 0.5*sValue
+    return dState
+
+
+def traceSection(engine: str, s0: np.ndarray, niter: int, nstep: int, batch: bool, **kwargs):
+    # returns the section points (s, theta) of the lines, shape (niter+1, nLine, 2), and the stats of all the lines
+    dZeta = 2 * np.pi / nfp / nstep
+    groups = [np.arange(len(s0))] if batch else [np.array([i]) for i in range(len(s0))]
+    section = np.empty((niter+1, len(s0), 2))
+    section[0, :, 0], section[0, :, 1] = s0, 0
+    stats = TracingStats()
+    startTime = time.perf_counter()
+    for group in groups:
+        state = np.stack((s0[group], np.zeros(len(group))), axis=1).flatten()
+        fun = instrumentFun(getB_many, stats, 2)
+        samples = engine(fun, 0.0, dZeta, niter*nstep, state, stats=stats, **kwargs)
+        for k, (_zeta, state) in enumerate(samples, start=1):
+            if k % nstep == 0:
+                section[k//nstep, group, 0], section[k//nstep, group, 1] = state[0::2], state[1::2]
+    stats.totalTime = time.perf_counter() - startTime
+    return section, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the field-line tracing engines on a model island field.")
+    parser.add_argument("--niter", type=int, default=200, help="number of toroidal periods")
+    parser.add_argument("--lines", type=int, default=16, help="number of lines")
+    parser.add_argument("--nstep", type=int, default=32, help="number of intervals per period")
+    args = parser.parse_args()
+    s0 = np.linspace(-0.3, 0.3, args.lines)
+    cases = [
+        ("LSODA rtol=1e-10, default (restart)", restartSamples, False, {"method": "LSODA", "rtol": 1e-10}),
+        ("LSODA rtol=1e-10, batch, continuous", continuousSamples, True, {"method": "LSODA", "rtol": 1e-10, "lband": 1, "uband": 1}),
+        ("LSODA rtol=1e-12, batch, continuous", continuousSamples, True, {"method": "LSODA", "rtol": 1e-12, "lband": 1, "uband": 1}),
+        ("fixed RK4, substep=1", fixedStepSamples, True, {"method": "RK4", "substep": 1}),
+        ("fixed RK4, substep=2", fixedStepSamples, True, {"method": "RK4", "substep": 2}),
+        ("fixed RK45, substep=1", fixedStepSamples, True, {"method": "RK45", "substep": 1}),
+        ("fixed DOP853, substep=1", fixedStepSamples, True, {"method": "DOP853", "substep": 1}),
+    ]
+    reference, _stats = traceSection(fixedStepSamples, s0, args.niter, args.nstep, True, method="DOP853", substep=4)
+    print("{:<40s}{:>10s}{:>16s}{:>10s}".format("engine", "error", "field points", "time (s)"))
+    for name, engine, batch, kwargs in cases:
+        section, stats = traceSection(engine, s0, args.niter, args.nstep, batch, **kwargs)
+        error = np.max(np.abs(section - reference))
+        print("{:<40s}{:>10.1e}{:>16d}{:>10.2f}".format(name, error, stats.nFieldPoint, stats.totalTime))
+
+
+if __name__ == "__main__":
+    main()
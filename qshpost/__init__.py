@@ -1,10 +1,16 @@
-from ._checkLog import checkLog
+from ._checkLog import checkLog, scanLogs, LogStatus
 from ._renewInput import renewInput
 from .bifurcation import findBifurcation
 from .successCase import SuccessCase
 from .axis import Axis
-from .crossSurface import OldCrossSurface, FirstCrossSurface, SecondCrossSurface
-from .flux import getFirstFlux, getSecondFlux
+from .crossSurface import OldCrossSurface, FirstCrossSurface, SecondCrossSurface, CrossSurfaceFamily
+from .flux import getFirstFlux, getSecondFlux, getFluxProfile
 from .iota import getFirstIota, getSecondIota
 from .tracing import traceLine
-from .pinch_reversal import getPinchReversalPara
+from .pinch_reversal import getPinchReversalPara, getPinchReversalParaMany
+from .gridCache import GridCache
+from .lineStore import traceToH5, readLinesH5
+from .scan import scanCase, iterScan, scanBifurcation
+from .adaptive import traceAdaptive
+from .fixedPoint import findAxis, findAxes
+from .returnMap import ReturnMap
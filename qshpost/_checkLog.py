@@ -1,55 +1,128 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
 
-def checkLog(specFile: List[str] or List[List[str]], logFile: str="log.txt", successWrite: str=None) -> List[str]:
+class LogStatus:
+    """
+    The final status of one SPEC run, from the last line containing "finished" in its log.
+        logFile: the log file.
+        found: if the "finished" line is found, `False` for a run which is still going or has crashed.
+        success: if a "finished" line also contains "success" (only the last one with `anySuccess=False` of `scanLog`).
+        summary: the "finished" line and the lines after it (at most `nLines` of `scanLog`), without the line breaks.
+    """
+
+    def __init__(self, logFile: str, found: bool=False, success: bool=False, summary: List[str]=None) -> None:
+        self.logFile = logFile
+        self.found = found
+        self.success = success
+        self.summary = list() if summary is None else summary
+
+    def __repr__(self) -> str:
+        return "LogStatus(logFile=" + self.logFile + ", found=" + str(self.found) + ", success=" + str(self.success) + ")"
+
+
+def scanLog(logFile: str, nLines: int=2, blockSize: int=65536, anySuccess: bool=True) -> LogStatus:
+    """
+    Find the last "finished" line of a log by reading the file backwards from its end in blocks of `blockSize` bytes,
+    so a finished run costs one block whatever the size of the log.
+    Args:
+        anySuccess: if `True`, the run is a success if any "finished" line contains "success" (the former rule of `checkLog`),
+            so the earlier lines are read as well when the last one is not a success. Otherwise only the last one decides.
+    """
+    key = b"finished"
+    status = LogStatus(logFile)
+    after = list()          # the complete lines after the current one, nearest first
+    with open(logFile, "rb") as f:
+        for line in _reverseLines(f, blockSize):
+            if key not in line:
+                if not status.found:
+                    after = [line] + after[0:nLines-1]
+            elif not status.found:
+                status = _logStatus(logFile, line, after)
+                if status.success or not anySuccess:
+                    return status
+            elif b"success" in line:
+                status.success = True
+                return status
+    return status
+
+
+def _reverseLines(f, blockSize: int):
+    # the lines of a binary file from the last to the first one, without the line breaks
+    pos = f.seek(0, os.SEEK_END)
+    fragment = None         # the part of the first line read so far, which may continue before the block
+    while pos > 0:
+        size = min(blockSize, pos)
+        pos -= size
+        f.seek(pos)
+        block = f.read(size)
+        parts = (block + fragment).split(b"\n") if fragment is not None else block.split(b"\n")
+        if fragment is None and parts[-1] == b"":
+            # the line break at the end of the file does not start a new line
+            parts.pop()
+        fragment = parts[0]
+        yield from reversed(parts[1:])
+    if fragment is not None:
+        yield fragment
+
+
+def _logStatus(logFile: str, line: bytes, after: List[bytes]) -> LogStatus:
+    summary = [text.decode(errors="replace").rstrip("\r") for text in [line] + after]
+    return LogStatus(logFile, found=True, success="success" in summary[0], summary=summary)
+
+
+def scanLogs(logFiles: List[str], workers: int=16, **kwargs) -> List[LogStatus]:
+    """
+    `scanLog` of many logs, read concurrently by `workers` threads (the scan waits on the file system, not on Python).
+    returns:
+        the status records in the order of `logFiles`.
+    """
+    if workers is None or workers <= 1 or len(logFiles) <= 1:
+        return [scanLog(file, **kwargs) for file in logFiles]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda file: scanLog(file, **kwargs), logFiles))
+
+
+def checkLog(specFile: List[str] or List[List[str]], logFile: str="log.txt", successWrite: str=None, workers: int=16) -> List[str]:
+    """
+    Args:
+        workers: number of threads reading the logs, see `scanLogs`.
+    """
 
     if isinstance(specFile[0], str):
-        log = list()
-        successList = list()
-        for file in specFile:
-            file = file.replace("sp", "log")
-            with open(file, 'r') as f:
-                log.append("=============================================================\n")
-                log.append(file+": \n")
-                for line in f:
-                    if "finished" in line:
-                        if "success" in line:
-                            successList.append(file.replace(".log",".sp"))
-                        log.append(line)
-                        log.append(f.readline())
-                        log.append(f.readline())
-                        log.append("\n")
-                        continue
-        with open(logFile, "w") as f:
-            for line in log:
-                f.write(line)
+        fileLists = [specFile]
     elif isinstance(specFile[0], List) and isinstance(specFile[0][0], str):
-        log = list()
-        successList = list()
-        for fileList in specFile:
-            _sList = list()
-            for file in fileList:
-                file = file.replace("sp", "log")
-                with open(file, 'r') as f:
-                    log.append("=============================================================\n")
-                    log.append(file+": \n")
-                    for line in f:
-                        if "finished" in line:
-                            if "success" in line:
-                                _sList.append(file.replace(".log",".sp"))
-                            log.append(line)
-                            log.append(f.readline())
-                            log.append(f.readline())
-                            log.append("\n")
-                            continue
-            successList.append(_sList)
-        with open(logFile, "w") as f:
-            for line in log:
-                f.write(line)
+        fileLists = specFile
     else:
         raise TypeError (
             "Check the type of specFile! "
         )
+    logFiles = [file.replace(".sp", ".log") for fileList in fileLists for file in fileList]
+    statusList = scanLogs(logFiles, workers=workers)
+
+    log = list()
+    successList = list()
+    index = 0
+    for fileList in fileLists:
+        _sList = list()
+        for _file in fileList:
+            status = statusList[index]
+            index += 1
+            log.append("=============================================================\n")
+            log.append(status.logFile+": \n")
+            if status.found:
+                if status.success:
+                    _sList.append(status.logFile.replace(".log",".sp"))
+                for line in status.summary:
+                    log.append(line + "\n")
+                log.append("\n")
+        successList.append(_sList)
+    if isinstance(specFile[0], str):
+        successList = successList[0]
+    with open(logFile, "w") as f:
+        for line in log:
+            f.write(line)
 
     if successWrite != None:
         with open(successWrite, 'w') as f:
@@ -61,5 +134,3 @@ def checkLog(specFile: List[str] or List[List[str]], logFile: str="log.txt", suc
                         f.write(file_name + "\n")
 
     return successList
-
-    
\ No newline at end of file
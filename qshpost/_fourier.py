@@ -0,0 +1,150 @@
+import warnings
+import numpy as np
+from typing import List, Tuple
+
+
+def _uniformPeriod(angleArr: np.ndarray) -> int or None:
+    # the number of samples per period if the angles are `angle0 + 2*pi*k/period`, k = 0, ..., nums-1, and nums is a multiple of period
+    nums = angleArr.size
+    if nums < 2:
+        return None
+    step = (angleArr[-1] - angleArr[0]) / (nums - 1)
+    if step <= 0:
+        return None
+    period = int(round(2 * np.pi / step))
+    if period < 2 or nums % period != 0 or abs(period*step - 2*np.pi) > 1e-10 * 2*np.pi:
+        return None
+    if np.max(np.abs(np.diff(angleArr) - step)) > 1e-10 * step:
+        return None
+    return period
+
+
+def fitFourier(angleArr: np.ndarray, valueArr: np.ndarray, xm: np.ndarray, kind: str="both", fft: bool=True, debug: bool=False) -> Tuple[np.ndarray]:
+    r"""
+    Linear least squares fit of
+        value = \sum (cos * cos(xm*angle) + sin * sin(xm*angle))
+    The design matrix is built once and the fit is one `lstsq`. If the angles are uniform and cover whole periods, the integer
+    harmonics below the Nyquist one are orthogonal on the samples and the fit is a FFT of the samples folded into one period.
+    Args:
+        angleArr: the sample angles, with the shape (nums, ).
+        valueArr: the values with the shape (nums, ), or (nums, nCurve) to fit several curves on the same samples at once.
+        xm: the harmonics.
+        kind: `"cos"`, `"sin"` or `"both"`, the terms in the fit.
+        fft: if `False`, the FFT path is not used.
+        debug: if `True`, the output of `np.linalg.lstsq` is returned instead (the FFT path is not used).
+    returns:
+        cos, sin: the coefficients with the shape (len(xm), ) or (len(xm), nCurve), the coefficients not in `kind` are zeros.
+    """
+    angleArr = np.asarray(angleArr, dtype=float).flatten()
+    valueArr = np.asarray(valueArr, dtype=float)
+    xm = np.asarray(xm).flatten()
+    assert valueArr.shape[0] == angleArr.size
+    if kind not in ("cos", "sin", "both"):
+        raise ValueError(
+            "`kind` should be `cos`, `sin` or `both`. "
+        )
+    period = _uniformPeriod(angleArr) if (fft and not debug) else None
+    if (
+        period is not None and np.all(xm == np.round(xm)) and np.all(np.abs(xm) < period/2) and 
+        np.unique(np.abs(xm)).size == xm.size
+    ):
+        # average over the periods, then the discrete Fourier transform of one period
+        folded = valueArr.reshape((-1, period) + valueArr.shape[1:]).mean(axis=0)
+        spectrum = np.fft.rfft(folded, axis=0) / period
+        harmonic = np.abs(xm).astype(int)
+        phase = np.exp(-1j*harmonic*angleArr[0]).reshape((-1, ) + (1, )*(valueArr.ndim-1))
+        coeff = phase * spectrum[harmonic]
+        factor = np.where(harmonic == 0, 1, 2).reshape(phase.shape)
+        cosCoeff = factor * coeff.real
+        sinCoeff = - factor * coeff.imag * np.sign(xm).reshape(phase.shape)
+        if kind == "cos":
+            sinCoeff = np.zeros_like(sinCoeff)
+        elif kind == "sin":
+            cosCoeff = np.zeros_like(cosCoeff)
+        return cosCoeff, sinCoeff
+    angleMat = np.outer(angleArr, xm)
+    if kind == "cos":
+        designMat = np.cos(angleMat)
+    elif kind == "sin":
+        designMat = np.sin(angleMat)
+    else:
+        designMat = np.concatenate((np.cos(angleMat), np.sin(angleMat)), axis=1)
+    result = np.linalg.lstsq(designMat, valueArr, rcond=None)
+    if debug:
+        return result
+    coeff = result[0]
+    zeros = np.zeros((xm.size, ) + valueArr.shape[1:])
+    if kind == "cos":
+        return coeff, zeros
+    elif kind == "sin":
+        return zeros, coeff
+    return coeff[0:xm.size], coeff[xm.size:2*xm.size]
+
+
+def _warnIgnored(kwargs: dict):
+    # the fits were nonlinear `least_squares` solves, whose options (such as `verbose`) mean nothing to the linear fits
+    if len(kwargs) > 0:
+        warnings.warn(
+            "The options " + ", ".join(sorted(kwargs)) + " are ignored by the linear least squares fit. ", stacklevel=3
+        )
+
+
+def _harmonicBasis(angleArr: np.ndarray, xm: np.ndarray) -> np.ndarray:
+    # exp(i*xm*angle) with the shape (nums, len(xm)), by the recurrence exp(i*k*g*angle) = exp(i*(k-1)*g*angle) * exp(i*g*angle)
+    # where g is the greatest common divisor of the integer harmonics; other harmonics are evaluated directly
+    if not np.all(xm == np.round(xm)) or not np.any(xm != 0):
+        return np.exp(1j*np.outer(angleArr, xm))
+    harmonic = np.abs(xm).astype(int)
+    base = np.gcd.reduce(harmonic[harmonic != 0])
+    power = np.empty((angleArr.size, harmonic.max()//base+1), dtype=complex)
+    power[:, 0] = 1
+    power[:, 1] = np.exp(1j*base*angleArr)
+    for k in range(2, power.shape[1]):
+        power[:, k] = power[:, k-1] * power[:, 1]
+    basis = power[:, harmonic//base]
+    return np.where(xm < 0, basis.conj(), basis)
+
+
+def evalFourier(
+    angleArr: np.ndarray, xm: np.ndarray, cosCoeff: np.ndarray=None, sinCoeff: np.ndarray=None, 
+    derivative: int or List[int]=0, chunk: int=65536
+) -> np.ndarray or Tuple[np.ndarray]:
+    r"""
+    Evaluate
+        value = \sum (cos * cos(xm*angle) + sin * sin(xm*angle))
+    and its derivatives in angle. The points are processed in chunks of `chunk`, and the harmonics are built by a recurrence, 
+    so the temporaries are of the size `chunk * len(xm)` and there is no sin or cos call per harmonic. 
+    Args:
+        cosCoeff, sinCoeff: the coefficients with the shape (len(xm), ), or (len(xm), nSet) to evaluate several series on the 
+            same angles at once. `None` means zeros. 
+        derivative: the order of the derivative, or a list of orders. 
+    returns:
+        the values with the shape (nums, ) or (nums, nSet), a tuple of them if `derivative` is a list. 
+    """
+    angleArr = np.asarray(angleArr, dtype=float).flatten()
+    xm = np.asarray(xm, dtype=float).flatten()
+    if cosCoeff is None and sinCoeff is None:
+        raise ValueError(
+            "At least one of `cosCoeff` and `sinCoeff` should be given. "
+        )
+    cosCoeff = np.zeros_like(np.asarray(sinCoeff, dtype=float)) if cosCoeff is None else np.asarray(cosCoeff, dtype=float)
+    sinCoeff = np.zeros_like(cosCoeff) if sinCoeff is None else np.asarray(sinCoeff, dtype=float)
+    assert cosCoeff.shape == sinCoeff.shape and cosCoeff.shape[0] == xm.size
+    orders = [derivative] if np.ndim(derivative) == 0 else list(derivative)
+    # value = Re(\sum (cos - i*sin) * exp(i*xm*angle)), and each derivative multiplies the coefficients by i*xm
+    coeff = (cosCoeff - 1j*sinCoeff).reshape(xm.size, -1)
+    coeffList = [np.power(1j*xm, order).reshape(-1, 1) * coeff for order in orders]
+    valueList = [np.empty((angleArr.size, coeff.shape[1])) for _order in orders]
+    for start in range(0, angleArr.size, chunk):
+        rows = slice(start, min(start+chunk, angleArr.size))
+        basis = _harmonicBasis(angleArr[rows], xm)
+        for value, _coeff in zip(valueList, coeffList):
+            value[rows] = (basis @ _coeff).real
+    valueList = [value.reshape((angleArr.size, ) + cosCoeff.shape[1:]) for value in valueList]
+    if np.ndim(derivative) == 0:
+        return valueList[0]
+    return tuple(valueList)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,200 @@
+import time
+import numpy as np
+from scipy.integrate import RK23, RK45, DOP853, Radau, BDF, LSODA
+from typing import Callable, Iterator, Tuple
+
+
+_SOLVERS = {"RK23": RK23, "RK45": RK45, "DOP853": DOP853, "Radau": Radau, "BDF": BDF, "LSODA": LSODA}
+# Butcher tableaux (A, B, C) of the fixed-step schemes, the embedded RK pairs of scipy are used with their propagating weights
+_TABLEAUS = {
+    "RK4": (
+        np.array([[0, 0, 0, 0], [1/2, 0, 0, 0], [0, 1/2, 0, 0], [0, 0, 1, 0]]), 
+        np.array([1/6, 1/3, 1/3, 1/6]), 
+        np.array([0, 1/2, 1/2, 1])
+    ), 
+    **{name: (solver.A, solver.B, solver.C) for name, solver in (("RK23", RK23), ("RK45", RK45), ("DOP853", DOP853))}
+}
+
+
+class TracingStats:
+    """
+    Cost counters of one traced line (of one group of lines with `batch=True`).
+        nfev: number of right-hand-side calls.
+        nFieldPoint: number of points at which the field (and the interpolated grids) is evaluated.
+        njev, nlu: number of Jacobian evaluations and LU decompositions of the implicit solvers.
+        nStep: number of accepted steps.
+        nReject: number of rejected steps, `None` if the solver does not report them (LSODA, BDF, Radau).
+        fieldTime: wall time spent in the right-hand side, in seconds.
+        totalTime: wall time of the whole line, in seconds. `totalTime - fieldTime` is the overhead of the solver and of the bookkeeping.
+    """
+
+    def __init__(self) -> None:
+        self.nfev = 0
+        self.nFieldPoint = 0
+        self.njev = 0
+        self.nlu = 0
+        self.nStep = 0
+        self.nReject = 0
+        self.fieldTime = 0.0
+        self.totalTime = 0.0
+
+    @property
+    def solverTime(self) -> float:
+        return self.totalTime - self.fieldTime
+
+    def asDict(self) -> dict:
+        return {
+            "nfev": self.nfev, "nFieldPoint": self.nFieldPoint, "njev": self.njev, "nlu": self.nlu, 
+            "nStep": self.nStep, "nReject": self.nReject, 
+            "fieldTime": self.fieldTime, "solverTime": self.solverTime, "totalTime": self.totalTime
+        }
+
+    def __repr__(self) -> str:
+        return "TracingStats(" + ", ".join(key + "=" + str(value) for key, value in self.asDict().items()) + ")"
+
+
+def instrumentFun(fun: Callable, stats: TracingStats, nDim: int) -> Callable:
+    """
+    Wrap the right-hand side `fun` of lines with `nDim` components each, to count its calls, the field points inside
+    the volume (|s| <= 1) and its wall time in `stats`.
+    """
+    def wrapped(t, y):
+        start = time.perf_counter()
+        value = fun(t, y)
+        stats.fieldTime += time.perf_counter() - start
+        stats.nfev += 1
+        stats.nFieldPoint += int(np.count_nonzero(np.abs(y[0::nDim]) <= 1))
+        return value
+    return wrapped
+
+
+class IntegrationError(RuntimeError):
+    """
+    A step of the solver failed. The tracers stop the lines of the failing group there (with the status `"failed"`)
+    and go on with the other groups.
+    """
+
+
+def _step(solver, stats: TracingStats=None):
+    nfev = solver.nfev
+    message = solver.step()
+    if solver.status == "failed":
+        raise IntegrationError(
+            "The integration failed at t = " + str(solver.t) + ": " + str(message)
+        )
+    if stats is not None:
+        stats.nStep += 1
+        if hasattr(solver, "n_stages") and stats.nReject is not None:
+            # every attempt of an explicit Runge-Kutta step costs `n_stages` evaluations
+            stats.nReject += (solver.nfev - nfev) // solver.n_stages - 1
+        elif not hasattr(solver, "n_stages"):
+            stats.nReject = None
+
+
+def _addSolverStats(solver, stats: TracingStats=None):
+    if stats is not None:
+        stats.njev += solver.njev
+        stats.nlu += solver.nlu
+
+
+def restartSamples(fun: Callable, tStart: float, dt: float, nSample: int, y0: np.ndarray, method: str="LSODA", stats: TracingStats=None, **kwargs) -> Iterator[Tuple[float, np.ndarray]]:
+    """
+    Restart the solver on each interval [t, t+dt] (as `solve_ivp` without `t_eval`) and yield `(t+dt, y)` at the end of every interval.
+    Args:
+        method: the name of a `scipy.integrate.OdeSolver` (as in `solve_ivp`), or the solver class itself.
+        stats: if given, the steps of the solver are counted in it.
+        kwargs: options of the solver, such as `rtol`, `atol` and `max_step`.
+    """
+    solverClass = _SOLVERS[method] if isinstance(method, str) else method
+    t, y = tStart, np.asarray(y0, dtype=float)
+    for _k in range(nSample):
+        solver = solverClass(fun, t, y, t+dt, **kwargs)
+        while solver.status == "running":
+            _step(solver, stats)
+        _addSolverStats(solver, stats)
+        t, y = t+dt, solver.y
+        yield t, y
+
+
+def continuousSamples(fun: Callable, tStart: float, dt: float, nSample: int, y0: np.ndarray, method: str="LSODA", stats: TracingStats=None, **kwargs) -> Iterator[Tuple[float, np.ndarray]]:
+    """
+    Integrate over [tStart, tStart+nSample*dt] with a single stepper and yield `(t, y)` at the grid `tStart+k*dt`, `k = 1, ..., nSample`.
+    The grid values come from the dense output of the steps, so the stepper keeps its step size and history between samples.
+    Args:
+        method: the name of a `scipy.integrate.OdeSolver` (as in `solve_ivp`), or the solver class itself.
+        stats: if given, the steps of the solver are counted in it.
+        kwargs: options of the solver, such as `rtol`, `atol` and `max_step`.
+    """
+    solverClass = _SOLVERS[method] if isinstance(method, str) else method
+    tGrid = tStart + dt * np.arange(1, nSample+1)
+    solver = solverClass(fun, tStart, np.asarray(y0, dtype=float), tGrid[-1], **kwargs)
+    direction = np.sign(dt)
+    index = 0
+    try:
+        while index < nSample:
+            _step(solver, stats)
+            if direction * (tGrid[index] - solver.t) > 0:
+                continue
+            interp = solver.dense_output()
+            while index < nSample and direction * (tGrid[index] - solver.t) <= 0:
+                yield tGrid[index], interp(tGrid[index])
+                index += 1
+    finally:        # also when the caller stops early
+        _addSolverStats(solver, stats)
+
+
+def fixedStepSamples(fun: Callable, tStart: float, dt: float, nSample: int, y0: np.ndarray, method: str="RK4", substep: int=1, stats: TracingStats=None) -> Iterator[Tuple[float, np.ndarray]]:
+    """
+    Integrate with an explicit Runge-Kutta scheme of `substep` equal steps per interval and yield `(t, y)` at the grid `tStart+k*dt`, 
+    `k = 1, ..., nSample`. There is no error control: the cost is fixed to `substep * nStage` evaluations of `fun` per interval, 
+    and the error is of the order `(dt/substep)**order` per unit time. 
+    Since no step depends on the error of another component, the lines of a batch are advanced exactly as if they were alone. 
+    Args:
+        method: `"RK4"` (classic, order 4, 4 stages), `"RK23"` (order 3, 3 stages), `"RK45"` (Dormand-Prince, order 5, 6 stages) 
+            or `"DOP853"` (order 8, 12 stages). 
+        substep: number of steps per interval `dt`. 
+        stats: if given, the steps are counted in it. 
+    """
+    if method not in _TABLEAUS:
+        raise ValueError(
+            "The fixed-step `method` should be one of " + ", ".join(_TABLEAUS.keys()) + ". "
+        )
+    tableauA, tableauB, tableauC = _TABLEAUS[method]
+    nStage = len(tableauB)
+    h = dt / substep
+    y = np.array(y0, dtype=float)
+    slope = np.empty((nStage, y.size))
+    for index in range(nSample):
+        tInterval = tStart + index * dt
+        for j in range(substep):
+            t = tInterval + j * h
+            for stage in range(nStage):
+                slope[stage] = fun(t + tableauC[stage]*h, y + h * (tableauA[stage, :stage] @ slope[:stage]))
+            y = y + h * (tableauB @ slope)
+            if stats is not None:
+                stats.nStep += 1
+        yield tStart + (index+1) * dt, y
+
+
+def periodicTrapezoid(getValue: Callable, tol: float, nums: int, maxNums: int) -> np.ndarray:
+    """
+    The integrals over [0, 2*pi] of the rows of the periodic `getValue(labelArr)` by the trapezoidal rule, which is spectrally
+    accurate. The uniform points are doubled (reusing the former ones) from `nums` up to `maxNums` until two estimates differ
+    by less than `tol` (relative to the integral if it is larger than 1).
+    """
+    valueSum = np.sum(getValue(2*np.pi*np.arange(nums)/nums), axis=-1)
+    integral = 2 * np.pi / nums * valueSum
+    while nums < maxNums:
+        valueSum = valueSum + np.sum(getValue(2*np.pi*(np.arange(nums)+0.5)/nums), axis=-1)
+        nums = 2 * nums
+        newIntegral = 2 * np.pi / nums * valueSum
+        err = np.abs(newIntegral - integral)
+        integral = newIntegral
+        if np.all(err <= tol * np.maximum(np.abs(integral), 1)):
+            return integral
+    print("The integral is not converged to " + str(tol) + " with " + str(maxNums) + " points ...")
+    return integral
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,74 @@
+import numpy as np
+from typing import Tuple
+
+
+class GridInterpolator:
+    r"""
+    Trilinear interpolation of several components given on the same (s, \theta, \zeta) grid.
+    The grid is prepared once, and each call locates the points only once for all the components.
+    The angles are periodic (2\pi in \theta, 2\pi/nfp in \zeta), s is extrapolated linearly outside the grid.
+    """
+
+    def __init__(self, sArr: np.ndarray, thetaArr: np.ndarray, zetaArr: np.ndarray, *components: np.ndarray, nfp: int=1) -> None:
+        """
+        Args:
+            sArr, thetaArr, zetaArr: the 1D grids.
+            components: arrays with the shape (len(sArr), len(thetaArr), len(zetaArr), ...).
+            nfp: number of field periods.
+        """
+        data = np.stack([np.asarray(component, dtype=float) for component in components], axis=3)
+        assert data.shape[0:3] == (len(sArr), len(thetaArr), len(zetaArr))
+        self.shape = data.shape[4:]
+        data = data.reshape(data.shape[0:4] + (-1, ))
+        self.sArr = np.asarray(sArr, dtype=float)
+        self.thetaArr, data = self._closePeriod(np.asarray(thetaArr, dtype=float), data, 2*np.pi, 1)
+        self.zetaArr, data = self._closePeriod(np.asarray(zetaArr, dtype=float), data, 2*np.pi/nfp, 2)
+        self.thetaPeriod = 2 * np.pi
+        self.zetaPeriod = 2 * np.pi / nfp
+        self.data = np.ascontiguousarray(data)
+
+    @staticmethod
+    def _closePeriod(angleArr: np.ndarray, data: np.ndarray, period: float, axis: int) -> Tuple[np.ndarray]:
+        # append the first slice at `angle+period` if the grid does not cover the whole period
+        if angleArr[-1] - angleArr[0] < period * (1 - 1e-12):
+            angleArr = np.append(angleArr, angleArr[0]+period)
+            data = np.concatenate((data, np.take(data, [0], axis=axis)), axis=axis)
+        return angleArr, data
+
+    @staticmethod
+    def _locate(grid: np.ndarray, value: np.ndarray) -> Tuple[np.ndarray]:
+        index = np.clip(np.searchsorted(grid, value, side="right")-1, 0, len(grid)-2)
+        weight = (value - grid[index]) / (grid[index+1] - grid[index])
+        return index, weight
+
+    def __call__(self, sValue: np.ndarray, thetaValue: np.ndarray, zetaValue: np.ndarray) -> np.ndarray:
+        """
+        returns:
+            the values with the shape (nPoint, nComponent, ...), nPoint is the broadcast size of the coordinates.
+        """
+        sValue, thetaValue, zetaValue = np.broadcast_arrays(
+            np.atleast_1d(np.asarray(sValue, dtype=float)),
+            np.atleast_1d(np.asarray(thetaValue, dtype=float)),
+            np.atleast_1d(np.asarray(zetaValue, dtype=float))
+        )
+        thetaValue = self.thetaArr[0] + (thetaValue.ravel() - self.thetaArr[0]) % self.thetaPeriod
+        zetaValue = self.zetaArr[0] + (zetaValue.ravel() - self.zetaArr[0]) % self.zetaPeriod
+        i, wi = self._locate(self.sArr, sValue.ravel())
+        j, wj = self._locate(self.thetaArr, thetaValue)
+        k, wk = self._locate(self.zetaArr, zetaValue)
+        wi, wj, wk = wi[:,np.newaxis,np.newaxis], wj[:,np.newaxis,np.newaxis], wk[:,np.newaxis,np.newaxis]
+        value = (
+            (1-wi) * (
+                (1-wj) * ((1-wk)*self.data[i, j, k] + wk*self.data[i, j, k+1]) +
+                wj * ((1-wk)*self.data[i, j+1, k] + wk*self.data[i, j+1, k+1])
+            ) +
+            wi * (
+                (1-wj) * ((1-wk)*self.data[i+1, j, k] + wk*self.data[i+1, j, k+1]) +
+                wj * ((1-wk)*self.data[i+1, j+1, k] + wk*self.data[i+1, j+1, k+1])
+            )
+        )
+        return value.reshape((value.shape[0], value.shape[1]) + self.shape)
+
+
+if __name__ == "__main__":
+    pass
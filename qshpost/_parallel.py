@@ -0,0 +1,71 @@
+import multiprocessing
+import numpy as np
+from typing import Callable, Iterator, List
+
+
+_sharedState = dict()
+
+
+def _initWorker(shared: dict, setup: Callable=None):
+    global _sharedState
+    _sharedState = _withSetup(shared, setup)
+
+
+def _withSetup(shared: dict, setup: Callable=None) -> dict:
+    if setup is None:
+        return shared
+    return {**shared, **setup(**shared)}
+
+
+def _runTask(task: tuple):
+    func, kwargs = task
+    return func(**kwargs, **_sharedState)
+
+
+def splitIndex(nums: int, workers: int) -> List[np.ndarray]:
+    """
+    Split `range(nums)` into at most `workers` contiguous, non-empty chunks.
+    """
+    if nums == 0:
+        return list()
+    return [chunk for chunk in np.array_split(np.arange(nums), min(workers, nums)) if chunk.size > 0]
+
+
+def parallelIter(func: Callable, taskList: List[dict], workers: int, ordered: bool=True, setup: Callable=None, **shared) -> Iterator:
+    """
+    Evaluate `func(**task, **shared)` for every task in a process pool, and yield the results in the order of `taskList`
+    (in the order of completion if `ordered` is `False`) as soon as they are available. The keyword arguments in `shared` (the field and the grids) are handed to each worker
+    only once: they are inherited by fork where it is available, otherwise they are pickled once per worker by the pool initializer.
+    Args:
+        func: a module-level function.
+        taskList: keyword arguments of each task.
+        workers: number of processes.
+        setup: a module-level function called as `setup(**shared)`, which returns a dict of more shared arguments, such as the
+            field functions built from the grids. It is called once in the parent with fork (the workers inherit the result), 
+            otherwise once in each worker by the pool initializer, so the tasks do not build them again.
+    """
+    global _sharedState
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+        _sharedState = _withSetup(shared, setup)
+        initializer, initargs = None, ()
+    else:
+        context = multiprocessing.get_context()
+        initializer, initargs = _initWorker, (shared, setup)
+    try:
+        with context.Pool(processes=workers, initializer=initializer, initargs=initargs) as pool:
+            imap = pool.imap if ordered else pool.imap_unordered
+            yield from imap(_runTask, [(func, task) for task in taskList], chunksize=1)
+    finally:
+        _sharedState = dict()
+
+
+def parallelMap(func: Callable, taskList: List[dict], workers: int, **shared) -> List:
+    """
+    The list of the results of `parallelIter`.
+    """
+    return list(parallelIter(func, taskList, workers, **shared))
+
+
+if __name__ == "__main__":
+    pass
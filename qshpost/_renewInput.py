@@ -1,4 +1,5 @@
 from mpy import SPECNamelist
+from ._checkLog import scanLogs
 from typing import List, Tuple
 
 
@@ -52,20 +53,19 @@ def renewInput(inputList: List[str], fileName: str="renewName.txt", reverse: boo
 
 
 
-def checkCase(inputList: List[str]) -> Tuple[List]:
+def checkCase(inputList: List[str], workers: int=16) -> Tuple[List]:
+    """
+    Args:
+        workers: number of threads reading the logs, see `scanLogs`.
+    """
     successIndex = list()
     unSuccessIndex = list()
-    for index, file in enumerate(inputList):
-        state = False
-        file = file.replace(".sp", ".log")
-        with open(file, 'r') as f:
-            for line in f:
-                if "finished" in line and "success" in line:
-                    successIndex.append(index)
-                    state = True
-                    break
-            if not state:
-                unSuccessIndex.append(index)
+    statusList = scanLogs([file.replace(".sp", ".log") for file in inputList], workers=workers)
+    for index, status in enumerate(statusList):
+        if status.success:
+            successIndex.append(index)
+        else:
+            unSuccessIndex.append(index)
     return successIndex, unSuccessIndex
 
 
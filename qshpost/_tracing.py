@@ -1,9 +1,13 @@
+import time
 import numpy as np
-from scipy.integrate import solve_ivp 
 from mpy.specMagneticField import SPECField, FieldLine
 from mpy.specMagneticField import readJacobian, readB
 from mpy.misc import print_progress
-from typing import List
+from ._interpolate import GridInterpolator
+from ._integrate import restartSamples, continuousSamples, fixedStepSamples, instrumentFun, TracingStats, IntegrationError
+from ._parallel import parallelIter, splitIndex
+from .gridCache import GridCache
+from typing import Callable, Iterator, List, Tuple
 
 
 def traceLine(
@@ -12,7 +16,10 @@ def traceLine(
     niter: int=128, nstep: int=32,
     bMethod: str="calculate", 
     bData: str=None, jacobianData: str=None, 
-    printControl: bool=True, **kwargs
+    printControl: bool=True, batch: bool=False, workers: int=None, continuous: bool=False, sectionOnly: bool=False, 
+    cache: GridCache=None, specFile: str=None, 
+    stopOutside: bool=False, maxR: float=None, stopFunc: Callable=None, 
+    instrument: bool or Callable=False, integrator: str="solve_ivp", **kwargs
 ) -> List[FieldLine]:
     r"""
     Working in SPEC coordintes (s, \theta, \zeta), compute magnetic field lines by solving
@@ -27,39 +34,240 @@ def traceLine(
         niter: Number of toroidal periods. 
         nstep: Number of intermediate step for one period
         bMethod: should be `"calculate"` or "`interpolate`" , the method to get the magnetic field. 
+        batch: if `True`, the field lines with the same `zeta0` are advanced together as one system, 
+            the state is `[s_1, theta_1, s_2, theta_2, ...]` and the field is evaluated for all lines in one call. 
+            Lines which have left the volume (|s| > 1) are frozen. 
+        workers: number of processes, the initial points are split into contiguous chunks and traced in a process pool. 
+            The field is inherited (or pickled once) by each worker, and the lines are returned in the input order. 
+        continuous: if `True`, each line (or batch) is integrated by one stepper over all the `niter*nstep` intervals and sampled 
+            at the same zeta grid from its dense output, instead of restarting `solve_ivp` on every interval. 
+        sectionOnly: if `True`, only the crossings of the toroidal section (one point per period) are recorded, 
+            and the returned lines have `nZeta == 1`, so every point of them is a section point. 
+        cache: if given, the grids (computed or read from `bData`/`jacobianData`) are taken from this on-disk store. 
+        specFile: the SPEC output file of the field, used as the cache key when `bField.specData` does not know it. 
+        stopOutside: if `True`, a line stops before its first point outside the volume (|s| > 1). 
+        maxR: if given, a line stops at the first section crossing with R >= maxR. 
+        stopFunc: if given, `stopFunc(s, theta, zeta)` is called at each section crossing, and the line stops if it returns `True`. 
+        instrument: if `True`, each line gets a `stats` attribute (`TracingStats`: RHS calls, field points, steps, rejected steps, 
+            field and solver wall time), shared by the lines of a group with `batch=True`. 
+            If it is callable, it is also called as `instrument(index, stats)` for each finished line. 
+        integrator: `"solve_ivp"` (adaptive, `method` is a scipy solver, LSODA with `rtol=1e-10` by default) or `"fixed"` 
+            (explicit Runge-Kutta with `substep` equal steps per zeta interval, `method` is `"RK4"` (default), `"RK23"`, `"RK45"` or `"DOP853"`). 
+            The fixed-step engine always advances the lines with the same `zeta0` together, and each line gets the same result as alone. 
+            `benchmarks/tracingBenchmark.py` compares the accuracy and the cost of the engines on a model island field. 
+    returns:
+        the lines, each with a `status` attribute: `"finished"`, `"outside"`, `"maxR"`, `"callback"` or `"failed"` (a step of the 
+        solver failed, for all the running lines of its group). Stopped lines are truncated, and the other lines are traced on. 
+    """
+    lines = [None for _i in range(np.size(s0))]
+    for index, line in iterLine(
+        bField, s0, theta0, zeta0, niter=niter, nstep=nstep, bMethod=bMethod, bData=bData, jacobianData=jacobianData, 
+        printControl=printControl, batch=batch, workers=workers, continuous=continuous, sectionOnly=sectionOnly, 
+        cache=cache, specFile=specFile, stopOutside=stopOutside, maxR=maxR, stopFunc=stopFunc, instrument=instrument, 
+        integrator=integrator, **kwargs
+    ):
+        lines[index] = line
+    return lines
+
+
+def iterLine(
+    bField: SPECField, 
+    s0: np.ndarray, theta0: np.ndarray, zeta0: np.ndarray, 
+    bMethod: str="calculate", 
+    bData: str=None, jacobianData: str=None, 
+    printControl: bool=True, workers: int=None, 
+    cache: GridCache=None, specFile: str=None, skip: List[int]=None, instrument: bool or Callable=False, 
+    integrator: str="solve_ivp", gridData: tuple=None, **kwargs
+) -> Iterator[Tuple[int, FieldLine]]:
+    """
+    The generator form of `traceLine`, with the same arguments. It yields `(index, line)` as soon as each line is finished 
+    (with `batch=True`, as soon as its group is finished), so the caller does not need to keep the lines in memory. 
+    With `workers`, the lines are traced in chunks of about a quarter of the share of each worker, and yielded in the input order. 
+    Args:
+        skip: indices of the initial points which are not traced, such as the lines already written to disk. 
+        gridData: the grids returned by `getGridData`, so repeated calls do not prepare them again. 
     """
     if isinstance(s0, float):
         s0, theta0, zeta0 = np.array([s0]), np.array([theta0]), np.array([zeta0])
     elif isinstance(s0, list):
         s0, theta0, zeta0 = np.array(s0), np.array(theta0), np.array(zeta0)
     assert s0.shape == theta0.shape == zeta0.shape
-    if kwargs.get("method") is None:
-        kwargs.update({"method": "LSODA"}) 
-    if kwargs.get("rtol") is None:
-        kwargs.update({"rtol": 1e-10}) 
-    
+    if integrator == "solve_ivp":
+        if kwargs.get("method") is None:
+            kwargs.update({"method": "LSODA"}) 
+        if kwargs.get("rtol") is None:
+            kwargs.update({"rtol": 1e-10}) 
+    elif integrator == "fixed":
+        if kwargs.get("method") is None:
+            kwargs.update({"method": "RK4"}) 
+    else:
+        raise ValueError(
+            "`integrator` should be `solve_ivp` or `fixed`. "
+        )
+
+    if gridData is None:
+        gridData = getGridData(bField, bMethod, bData, jacobianData, cache, specFile)
+
+    skip = set() if skip is None else set(skip)
+    pending = np.array([i for i in range(len(s0)) if i not in skip], dtype=int)
+    if workers is not None and workers > 1:
+        if printControl:
+            print("Begin field-line tracing with " + str(workers) + " workers... ")
+        chunks = [pending[chunk] for chunk in splitIndex(len(pending), 4*workers)]
+        taskList = [{"s0": s0[chunk], "theta0": theta0[chunk], "zeta0": zeta0[chunk]} for chunk in chunks]
+        results = parallelIter(
+            _traceLines, taskList, workers, setup=_workerFunctions, 
+            bField=bField, bMethod=bMethod, gridData=gridData, printControl=False, instrument=bool(instrument), 
+            integrator=integrator, **kwargs
+        )
+        indexLines = ((int(index), line) for chunk, lines in zip(chunks, results) for index, line in zip(chunk, lines))
+    else:
+        indexLines = (
+            (int(pending[index]), line) for index, line in 
+            _iterLines(bField, bMethod, gridData, s0[pending], theta0[pending], zeta0[pending], printControl=printControl, instrument=bool(instrument), integrator=integrator, **kwargs)
+        )
+    for index, line in indexLines:
+        if callable(instrument):
+            instrument(index, line.stats)
+        yield index, line
+
+
+def getGridData(
+    bField: SPECField, bMethod: str="calculate", bData: str=None, jacobianData: str=None, 
+    cache: GridCache=None, specFile: str=None
+) -> tuple:
+    """
+    The grids used by the tracing: (sArr, thetaArr, zetaArr, Jacobian) for `bMethod="calculate"`, 
+    (sArr, thetaArr, zetaArr, B^s, B^theta, B^zeta) for `bMethod="interpolate"`. 
+    """
     if bMethod == "calculate":
-        from pyoculus.problems import SPECBfield
-        pyoculusField = SPECBfield(bField.specData, bField.lvol+1)
-        if jacobianData is None:
-            base_Jacobian = bField.getB()
-            base_sArr = bField.sArr
-            base_thetaArr = bField.thetaArr
-            base_zetaArr = bField.zetaArr
+        if jacobianData is None and cache is None:
+            gridData = (bField.sArr, bField.thetaArr, bField.zetaArr, bField.getJacobian())
+        elif jacobianData is None:
+            gridData = cache.getGrid(bField, "jacobian", specFile)
         else:
-            base_sArr, base_thetaArr, base_zetaArr, base_Jacobian = readJacobian(jacobianData)
+            gridData = readJacobian(jacobianData) if cache is None else cache.readJacobian(jacobianData)
     elif bMethod == "interpolate":
-        if bData is None:
-            base_bSupS, base_bSupTheta, base_bSupZeta = bField.getB()
-            base_sArr = bField.sArr
-            base_thetaArr = bField.thetaArr
-            base_zetaArr = bField.zetaArr
+        if bData is None and cache is None:
+            gridData = (bField.sArr, bField.thetaArr, bField.zetaArr, *bField.getB())
+        elif bData is None:
+            gridData = cache.getGrid(bField, "B", specFile)
         else:
-            base_sArr, base_thetaArr, base_zetaArr, base_bSupS, base_bSupTheta, base_bSupZeta = readB(bData)
+            gridData = readB(bData) if cache is None else cache.readB(bData)
     else:
         raise ValueError(
             "`bMethod` should be `calculate` or `interpolate`. "
         )
+    return gridData
+
+
+def _workerFunctions(bField: SPECField, bMethod: str, gridData: tuple, **kwargs) -> dict:
+    # the field functions shared by the tasks of one worker, so `SPECBfield` or `GridInterpolator` is built once per worker
+    return {"fieldFunctions": _fieldFunctions(bField, bMethod, gridData)}
+
+
+def _traceLines(**kwargs) -> List[FieldLine]:
+    lines = [None for _i in range(np.size(kwargs["s0"]))]
+    for index, line in _iterLines(**kwargs):
+        lines[index] = line
+    return lines
+
+
+def _iterLines(
+    bField: SPECField, bMethod: str, gridData: tuple, 
+    s0: np.ndarray, theta0: np.ndarray, zeta0: np.ndarray, 
+    niter: int=128, nstep: int=32, printControl: bool=True, 
+    batch: bool=False, continuous: bool=False, sectionOnly: bool=False, 
+    stopOutside: bool=False, maxR: float=None, stopFunc: Callable=None, instrument: bool=False, integrator: str="solve_ivp", 
+    fieldFunctions: Tuple[Callable]=None, **kwargs
+) -> Iterator[Tuple[int, FieldLine]]:
+
+    # `fieldFunctions` is the (getB_single, getB_many) of `_fieldFunctions`, built here if it is not given
+    getB_single, getB_many = _fieldFunctions(bField, bMethod, gridData) if fieldFunctions is None else fieldFunctions
+
+    if batch or integrator == "fixed":
+        getB = getB_many
+        # lines with the same starting zeta share the independent variable and can be integrated together
+        groups = [np.where(zeta0 == zetaValue)[0] for zetaValue in np.unique(zeta0)]
+        if kwargs["method"] == "LSODA" and kwargs.get("lband") is None and kwargs.get("uband") is None:
+            # each line only couples its own (s, theta) pair, so the Jacobian is banded
+            kwargs.update({"lband": 1, "uband": 1})
+    else:
+        getB = getB_single
+        groups = [np.array([i]) for i in range(len(s0))]
+
+    nGroup = len(groups)
+    dZeta = 2 * np.pi / bField.nfp / nstep
+    stride = nstep if sectionOnly else 1       # record every `stride` samples
+    nRecord = niter*nstep//stride + 1
+    stopControl = stopOutside or maxR is not None or stopFunc is not None
+    if printControl:
+        print("Begin field-line tracing: ")
+    for i, group in enumerate(groups):  # loop over each group of field-lines
+        state = np.stack((s0[group], theta0[group]), axis=1).flatten()
+        sArr = np.empty((nRecord, len(group)))
+        thetaArr = np.empty((nRecord, len(group)))
+        zetaArr = np.empty(nRecord)
+        sArr[0], thetaArr[0], zetaArr[0] = state[0::2], state[1::2], zeta0[group[0]]
+        startTime = time.perf_counter()
+        stats = TracingStats() if instrument else None
+        fun = getB if stats is None else instrumentFun(getB, stats, 2)
+        if integrator == "fixed":
+            samples = fixedStepSamples(fun, zetaArr[0], dZeta, niter*nstep, state, stats=stats, **kwargs)
+        elif continuous:
+            samples = continuousSamples(fun, zetaArr[0], dZeta, niter*nstep, state, stats=stats, **kwargs)
+        else:
+            samples = restartSamples(fun, zetaArr[0], dZeta, niter*nstep, state, stats=stats, **kwargs)
+        nPoint = np.full(len(group), nRecord)       # number of recorded points of each line
+        status = np.full(len(group), "finished", dtype=object)
+        kDone = 0       # number of samples finished
+        try:
+            for k, (zeta, state) in enumerate(samples, start=1):
+                if printControl and (k-1) % nstep == 0:
+                    print_progress(i*niter+(k-1)//nstep+1, nGroup*niter)
+                if k % stride == 0:
+                    sArr[k//stride], thetaArr[k//stride], zetaArr[k//stride] = state[0::2], state[1::2], zeta
+                kDone = k
+                if not stopControl:
+                    continue
+                newStatus = stopStatus(bField, state[0::2], state[1::2], zeta, k%nstep==0, stopOutside, maxR, stopFunc)
+                newStop = (newStatus != "") & (status == "finished")
+                if np.any(newStop):
+                    status[newStop] = newStatus[newStop]
+                    # an outside point is dropped, a point meeting maxR or stopFunc is kept
+                    nPoint[newStop] = np.where(newStatus[newStop] == "outside", (k-1)//stride+1, k//stride+1)
+                    if np.all(status != "finished"):
+                        break
+        except IntegrationError as error:
+            # only the lines of this group which are still running are stopped, at their last recorded point
+            failed = status == "finished"
+            status[failed] = "failed"
+            nPoint[failed] = kDone//stride + 1
+            if printControl:
+                print("The lines " + str([int(j) for j in group[failed]]) + " are stopped: " + str(error))
+        samples.close()
+        if stats is not None:
+            stats.totalTime = time.perf_counter() - startTime
+        for index, lineIndex in enumerate(group):
+            line = FieldLine.getLine_tracing(bField, nstep//stride, sArr[:nPoint[index],index], thetaArr[:nPoint[index],index], zetaArr[:nPoint[index]])
+            line.status = status[index]
+            if stats is not None:
+                line.stats = stats
+            yield lineIndex, line
+
+
+def _fieldFunctions(bField: SPECField, bMethod: str, gridData: tuple, pyoculusField=None) -> Tuple[Callable]:
+    # the right-hand sides (ds/dzeta, dtheta/dzeta) of the field-line equations, for one line with the state [s, theta], 
+    # and for many lines with the state [s_1, theta_1, s_2, theta_2, ...]; 
+    # `pyoculusField` is the `pyoculus.problems.SPECBfield` of `bField` for `"calculate"`, built here if it is not given
+    if bMethod == "calculate":
+        if pyoculusField is None:
+            from pyoculus.problems import SPECBfield
+            pyoculusField = SPECBfield(bField.specData, bField.lvol+1)
+        base_sArr, base_thetaArr, base_zetaArr, base_Jacobian = gridData
+    else:
+        # B^s, B^theta and B^zeta share one grid, so they are interpolated together
+        bInterpolator = GridInterpolator(*gridData, nfp=bField.nfp)
 
     def getB_calculate(zeta, s_theta):
         # field = pyoculusField.B_many(s_theta[0], s_theta[1], zeta) / bField.interpValue(base_Jacobian, s_theta[0], s_theta[1], zeta, sArr=base_sArr, thetaArr=base_thetaArr, zetaArr=base_zetaArr)
@@ -73,47 +281,60 @@ def traceLine(
         return [bSupS/bSupZeta, bSupTheta/bSupZeta]
     
     def getB_interpolate(zeta, s_theta):
-        bSupS = bField.interpValue(baseData=base_bSupS, sValue=s_theta[0], thetaValue=s_theta[1], zetaValue=zeta, sArr=base_sArr, thetaArr=base_thetaArr, zetaArr=base_zetaArr)
-        bSupTheta = bField.interpValue(baseData=base_bSupTheta, sValue=s_theta[0], thetaValue=s_theta[1], zetaValue=zeta, sArr=base_sArr, thetaArr=base_thetaArr, zetaArr=base_zetaArr)
-        bSupZeta = bField.interpValue(baseData=base_bSupZeta, sValue=s_theta[0], thetaValue=s_theta[1], zetaValue=zeta, sArr=base_sArr, thetaArr=base_thetaArr, zetaArr=base_zetaArr)
+        bSupS, bSupTheta, bSupZeta = bInterpolator(s_theta[0], s_theta[1], zeta)[0]
         return [bSupS/bSupZeta, bSupTheta/bSupZeta]
     
-    lines = list()
-    nLine = len(s0)
-    if printControl:
-        print("Begin field-line tracing: ")
-    for i in range(nLine):              # loop over each field-line 
-        s_theta = [s0[i], theta0[i]]
-        zetaStart = zeta0[i]
-        dZeta = 2 * np.pi / bField.nfp / nstep
-        sArr = [s0[i]]
-        thetaArr = [theta0[i]]
-        zetaArr = [zeta0[i]]
-        for j in range(niter):          # loop over each toroidal iteration
-            if printControl:
-                print_progress(i*niter+j+1, nLine*niter)
-            for k in range(nstep):      # loop inside one iteration
-                if bMethod == "calculate":
-                    sol = solve_ivp(
-                        getB_calculate, 
-                        (zetaStart, zetaStart+dZeta), 
-                        s_theta, **kwargs
-                    )
-                elif bMethod == "interpolate":
-                    sol = solve_ivp(
-                        getB_interpolate, 
-                        (zetaStart, zetaStart+dZeta), 
-                        s_theta, **kwargs
-                    )
-                else:
-                    raise ValueError("bMethod should be calculate or interpolate. ")
-                sArr.append(sol.y[0,-1])
-                thetaArr.append(sol.y[1,-1])
-                zetaArr.append(zetaStart+dZeta)
-                s_theta = [sArr[-1], thetaArr[-1]]
-                zetaStart = zetaArr[-1]
-        lines.append(FieldLine.getLine_tracing(bField, nstep, np.array(sArr), np.array(thetaArr), np.array(zetaArr)))
-    return lines
+    def getB_many(zeta, state):
+        sValue, thetaValue = state[0::2], state[1::2]
+        dState = np.zeros_like(state)
+        inside = np.abs(sValue) <= 1        # freeze the field lines which have left the volume
+        if not np.any(inside):
+            return dState
+        sValue, thetaValue = sValue[inside], thetaValue[inside]
+        zetaValue = zeta * np.ones_like(sValue)
+        if bMethod == "calculate":
+            field = pyoculusField.B_many(sValue, thetaValue, zetaValue) / bField.interpValue(base_Jacobian, sValue, thetaValue, zetaValue, sArr=base_sArr, thetaArr=base_thetaArr, zetaArr=base_zetaArr).reshape(-1,1)
+            bSupS = field[:, 0]
+            bSupTheta = field[:, 1]
+            bSupZeta = field[:, 2]
+        else:
+            field = bInterpolator(sValue, thetaValue, zetaValue)
+            bSupS = field[:, 0]
+            bSupTheta = field[:, 1]
+            bSupZeta = field[:, 2]
+        dState[0::2][inside] = bSupS / bSupZeta
+        dState[1::2][inside] = bSupTheta / bSupZeta
+        return dState
+
+    getB_single = getB_calculate if bMethod == "calculate" else getB_interpolate
+    return getB_single, getB_many
+
+
+def stopStatus(
+    bField: SPECField, sValue: np.ndarray, thetaValue: np.ndarray, zeta: float, section: bool, 
+    stopOutside: bool=False, maxR: float=None, stopFunc: Callable=None
+) -> np.ndarray:
+    """
+    Check the termination conditions of the lines at one sample. `maxR` and `stopFunc` are only checked at section crossings. 
+    returns:
+        the status of each line: `""` to continue, or `"outside"`, `"maxR"`, `"callback"` to stop. 
+    """
+    status = np.full(len(sValue), "", dtype=object)
+    inside = np.abs(sValue) <= 1
+    if stopOutside:
+        status[~inside] = "outside"
+    if not section or not np.any(inside):
+        return status
+    if maxR is not None:
+        rArr = FieldLine.getLine_tracing(bField, 1, sValue[inside], thetaValue[inside], zeta*np.ones(np.sum(inside))).rArr
+        hit = np.zeros(len(sValue), dtype=bool)
+        hit[inside] = rArr >= maxR
+        status[hit & (status == "")] = "maxR"
+    if stopFunc is not None:
+        hit = np.zeros(len(sValue), dtype=bool)
+        hit[inside] = [bool(stopFunc(s, theta, zeta)) for s, theta in zip(sValue[inside], thetaValue[inside])]
+        status[hit & (status == "")] = "callback"
+    return status
 
 
 if __name__ == "__main__":
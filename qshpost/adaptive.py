@@ -0,0 +1,141 @@
+import numpy as np
+from mpy.specMagneticField import SPECField, FieldLine
+from mpy.misc import print_progress
+from .axis import Axis
+from .crossSurface import FirstCrossSurface
+from .iota import _windingRate, _axisAngleIncrements
+from ._tracing import iterLine, getGridData
+from .gridCache import GridCache
+from typing import List
+
+
+class _SectionFit:
+    r"""
+    The running least squares fit of s(theta) = \sum (sSin*sin(xm*theta) + sCos*cos(xm*theta)) on the section points,
+    kept as the normal equations, so the points of a new block are added without fitting the former ones again.
+    """
+
+    def __init__(self, mpol: int) -> None:
+        self.xm = np.arange(mpol+1)
+        self.normalMat = np.zeros((2*(mpol+1), 2*(mpol+1)))
+        self.rightVec = np.zeros(2*(mpol+1))
+        self.sumSquare = 0.0
+        self.nums = 0
+
+    def add(self, thetaArr: np.ndarray, sArr: np.ndarray):
+        angleMat = np.outer(thetaArr, self.xm)
+        designMat = np.concatenate((np.sin(angleMat), np.cos(angleMat)), axis=1)
+        self.normalMat += designMat.T @ designMat
+        self.rightVec += designMat.T @ sArr
+        self.sumSquare += float(np.dot(sArr, sArr))
+        self.nums += len(sArr)
+
+    def solve(self) -> np.ndarray:
+        # the minimum norm solution, as the column of sin(0*theta) vanishes
+        return np.linalg.lstsq(self.normalMat, self.rightVec, rcond=None)[0]
+
+    def residual(self, coeff: np.ndarray) -> float:
+        # the root mean square residual of the fit
+        square = self.sumSquare - 2*np.dot(coeff, self.rightVec) + coeff @ self.normalMat @ coeff
+        return float(np.sqrt(max(square, 0) / max(self.nums, 1)))
+
+
+def traceAdaptive(
+    bField: SPECField,
+    s0: np.ndarray, theta0: np.ndarray, zeta0: np.ndarray,
+    blockIter: int=16, maxIter: int=1024, nstep: int=32,
+    tolIota: float=1e-8, tolFit: float=1e-6, mpol: int=12, axis: Axis=None, iotaMethod: str="birkhoff",
+    bMethod: str="calculate", bData: str=None, jacobianData: str=None, cache: GridCache=None, specFile: str=None,
+    printControl: bool=True, **kwargs
+) -> List[FieldLine]:
+    """
+    Trace the field lines in blocks of `blockIter` toroidal periods, and stop each line when its estimates have converged,
+    instead of tracing a fixed `niter`.
+    After each block, the iota of the line is updated from the angle increments of the new block (`getFirstIota`, or
+    `getSecondIota` about `axis` if it is given), and, without `axis`, the points of the new section crossings are added to the
+    running fit of s(theta) (as `FirstCrossSurface`). A line stops when the iota changes by less than `tolIota` and the fit
+    coefficients by less than `tolFit` over one block, when it is stopped by the tracing (such as `stopOutside`), or at `maxIter`.
+    Args:
+        iotaMethod: `"birkhoff"` or `"ratio"`, see `getFirstIota`.
+        kwargs: the options of `_tracing.traceLine`, such as `method`, `rtol` and `integrator`.
+    returns:
+        the lines, each with the attributes `nIter` (the number of toroidal periods traced), `iota`, `converged`, `status`,
+        and without `axis` also `crossSurface` (the `FirstCrossSurface` of the running fit) and `fitResidual` (its RMS residual).
+    """
+    s0, theta0, zeta0 = np.atleast_1d(s0).astype(float), np.atleast_1d(theta0).astype(float), np.atleast_1d(zeta0).astype(float)
+    assert s0.shape == theta0.shape == zeta0.shape
+    nums = len(s0)
+    gridData = getGridData(bField, bMethod, bData, jacobianData, cache, specFile)
+    sList = [[np.array([s0[i]])] for i in range(nums)]
+    thetaList = [[np.array([theta0[i]])] for i in range(nums)]
+    zetaList = [[np.array([zeta0[i]])] for i in range(nums)]
+    angleList = [list() for _i in range(nums)]
+    fitList = [_SectionFit(mpol) for _i in range(nums)]
+    for i in range(nums):
+        fitList[i].add(theta0[i:i+1], s0[i:i+1])
+    iotaArr = np.full(nums, np.nan)
+    coeffList = [None for _i in range(nums)]
+    nIter = np.zeros(nums, dtype=int)
+    converged = np.zeros(nums, dtype=bool)
+    status = np.full(nums, "finished", dtype=object)
+    active = np.arange(nums)
+    if printControl:
+        print("Begin adaptive field-line tracing: ")
+    while len(active) > 0:
+        niter = min(blockIter, maxIter - int(np.min(nIter[active])))
+        lastS = np.array([sList[i][-1][-1] for i in active])
+        lastTheta = np.array([thetaList[i][-1][-1] for i in active])
+        lastZeta = np.array([zetaList[i][-1][-1] for i in active])
+        stillActive = list()
+        for index, line in iterLine(
+            bField, lastS, lastTheta, lastZeta, niter=niter, nstep=nstep, bMethod=bMethod, gridData=gridData,
+            printControl=False, **kwargs
+        ):
+            i = active[index]
+            nIter[i] += niter
+            sList[i].append(line.sArr[1:])
+            thetaList[i].append(line.thetaArr[1:])
+            zetaList[i].append(line.zetaArr[1:])
+            if axis is None:
+                angleList[i].append(np.diff(line.thetaArr))
+            else:
+                angleList[i].append(_axisAngleIncrements(line.rArr, line.zArr, line.zetaArr, axis))
+            angleArr = np.concatenate(angleList[i])
+            zetaStep = np.diff(np.concatenate(zetaList[i]))
+            newIota = _windingRate(angleArr, zetaStep, iotaMethod, False) if len(angleArr) > 0 else np.nan
+            iotaChange = abs(newIota - iotaArr[i])
+            iotaArr[i] = newIota
+            fitChange = 0.0
+            if axis is None:
+                fitList[i].add(line.thetaArr[nstep::nstep], line.sArr[nstep::nstep])
+                newCoeff = fitList[i].solve()
+                fitChange = np.inf if coeffList[i] is None else float(np.max(np.abs(newCoeff - coeffList[i])))
+                coeffList[i] = newCoeff
+            lineStatus = getattr(line, "status", "finished")
+            if lineStatus != "finished":
+                status[i] = lineStatus
+            elif iotaChange < tolIota and fitChange < tolFit:
+                converged[i] = True
+            elif nIter[i] < maxIter:
+                stillActive.append(i)
+        active = np.array(stillActive, dtype=int)
+        if printControl:
+            print_progress(nums-len(active), nums)
+
+    lines = list()
+    for i in range(nums):
+        line = FieldLine.getLine_tracing(bField, nstep, np.concatenate(sList[i]), np.concatenate(thetaList[i]), np.concatenate(zetaList[i]))
+        line.nIter = int(nIter[i])
+        line.iota = float(iotaArr[i])
+        line.converged = bool(converged[i])
+        line.status = status[i]
+        if axis is None:
+            coeff = fitList[i].solve()
+            line.crossSurface = FirstCrossSurface(xm=fitList[i].xm, sSin=coeff[0:mpol+1], sCos=coeff[mpol+1:2*mpol+2])
+            line.fitResidual = fitList[i].residual(coeff)
+        lines.append(line)
+    return lines
+
+
+if __name__ == "__main__":
+    pass
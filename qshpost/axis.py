@@ -3,7 +3,7 @@ import mpy
 import mpy.specMagneticField as specMagneticField
 import numpy as np
 from scipy.integrate import dblquad
-from scipy.optimize import least_squares
+from ._fourier import fitFourier, evalFourier, _warnIgnored
 from typing import Tuple
 
 
@@ -35,41 +35,25 @@ class Axis:
     @classmethod
     def traceLine(cls, ntor: int, line: specMagneticField.FieldLine, specData: mpy.SPECOut, **kwargs):
         """
-        Use the least squares method to fit the axis curve! 
+        Use the linear least squares method to fit the axis curve! 
+        R and Z are linear in the coefficients, so the fit is one `lstsq` (a FFT for uniform samples over whole periods). 
+        A warning is issued for any `kwargs` (they were the options of the former nonlinear fit). 
         """
+        _warnIgnored(kwargs)
         xn = specData.output.in_[0: 2*ntor+1]
-        nums = len(xn)
-        if kwargs.get("verbose") is None:
-            kwargs.update({"verbose": 1}) 
-        def getValue(coeffArr: np.ndarray) -> Tuple[np.ndarray]:
-            rac = coeffArr[0: nums]
-            zas = coeffArr[nums: 2*nums]
-            angleMat = - np.dot(xn.reshape(-1,1), line.zetaArr.reshape(1,-1))
-            rArr = (
-                np.dot(rac.reshape(1,-1), np.cos(angleMat))
-            ).flatten()
-            zArr = (
-                np.dot(zas.reshape(1,-1), np.sin(angleMat))
-            ).flatten()
-            return rArr, zArr
-        def getErr(coeffArr: np.ndarray) -> np.ndarray:
-            rArr, zArr = getValue(coeffArr)
-            return np.append(
-                np.power(rArr-line.rArr,2), np.power(zArr-line.zArr,2)
-            )
-        optimizeRes = least_squares(getErr, np.zeros(2*nums), bounds=(-np.inf, np.inf), **kwargs)
-        assert optimizeRes.success
-        return cls(initPoint=np.array([line.sArr[0],line.thetaArr[0],line.zetaArr[0]]), xn=xn, rac=optimizeRes.x[0:nums], zas=optimizeRes.x[nums:2*nums])
+        # R = \sum rac cos(xn*zeta), Z = - \sum zas sin(xn*zeta)
+        rac, _ras = fitFourier(line.zetaArr, line.rArr, xn, kind="cos")
+        _zac, zas = fitFourier(line.zetaArr, line.zArr, xn, kind="sin")
+        return cls(initPoint=np.array([line.sArr[0],line.thetaArr[0],line.zetaArr[0]]), xn=xn, rac=rac, zas=-zas)
 
     def getRZ(self, zetaArr: np.ndarray) -> Tuple[np.ndarray]:
-        angleMat = - np.dot(self.xn.reshape(-1,1), zetaArr.reshape(1,-1))
-        rArr = (
-            np.dot(self.rac.reshape(1,-1), np.cos(angleMat))
-        ).flatten()
-        zArr = (
-            np.dot(self.zas.reshape(1,-1), np.sin(angleMat))
-        ).flatten()
-        return rArr, zArr
+        # R = \sum rac cos(xn*zeta), Z = - \sum zas sin(xn*zeta), evaluated together
+        rz = evalFourier(
+            zetaArr, self.xn, 
+            cosCoeff=np.stack((self.rac.flatten(), np.zeros(self.zas.size)), axis=1), 
+            sinCoeff=np.stack((np.zeros(self.rac.size), -self.zas.flatten()), axis=1)
+        )
+        return rz[:, 0], rz[:, 1]
 
     def getXYZ(self, zetaArr: np.ndarray) -> Tuple[np.ndarray]:
         rArr, zArr = self.getRZ(zetaArr)
@@ -77,7 +61,75 @@ class Axis:
         yArr = np.sin(zetaArr) * rArr
         return xArr, yArr, zArr
 
-    def getWrithe(self) -> float:
+    def getDerivatives(self, zetaArr: np.ndarray, order: int=3) -> Tuple[np.ndarray]:
+        """
+        returns:
+            the points (x, y, z) of the axis curve and their derivatives in zeta up to `order` (at most 3), each with the shape (nums, 3). 
+        """
+        # the derivatives of R = \sum rac cos(xn*zeta) and Z = - \sum zas sin(xn*zeta)
+        rz = evalFourier(
+            zetaArr, self.xn, 
+            cosCoeff=np.stack((self.rac.flatten(), np.zeros(self.zas.size)), axis=1), 
+            sinCoeff=np.stack((np.zeros(self.rac.size), -self.zas.flatten()), axis=1), 
+            derivative=[0, 1, 2, 3]
+        )
+        rDerivative = [value[:, 0] for value in rz]
+        zDerivative = [value[:, 1] for value in rz]
+        # x + iy = R exp(i*zeta)
+        phase = np.exp(1j*zetaArr)
+        r = rDerivative
+        complexDerivative = [
+            r[0] * phase, 
+            (r[1] + 1j*r[0]) * phase, 
+            (r[2] + 2j*r[1] - r[0]) * phase, 
+            (r[3] + 3j*r[2] - 3*r[1] - 1j*r[0]) * phase
+        ]
+        return tuple(
+            np.stack((complexDerivative[k].real, complexDerivative[k].imag, zDerivative[k]), axis=1) for k in range(order+1)
+        )
+
+    def _getWritheGrid(self, nums: int, chunk: int=256) -> float:
+        # the trapezoid rule of the Gauss integral on the uniform nums x nums grid, with the diagonal treated analytically
+        zetaArr = 2 * np.pi * np.arange(nums) / nums
+        xyz, dXYZ, ddXYZ, dddXYZ = self.getDerivatives(zetaArr, order=3)
+        value = 0.0
+        for start in range(0, nums, chunk):
+            rows = np.arange(start, min(start+chunk, nums))
+            deltaXYZ = xyz[np.newaxis,:,:] - xyz[rows,np.newaxis,:]
+            norm = np.linalg.norm(deltaXYZ, axis=2)
+            norm[rows-start, rows] = 1
+            integrand = np.einsum("ijk,ijk->ij", np.cross(dXYZ[rows,np.newaxis,:], dXYZ[np.newaxis,:,:]), deltaXYZ) / np.power(norm,3)
+            # the integrand vanishes on the diagonal
+            integrand[rows-start, rows] = 0
+            value += np.sum(integrand)
+        step = 2 * np.pi / nums
+        # near the diagonal the integrand is a*|zeta2-zeta1| with a = - det(X^(1), X^(2), X^(3)) / (12 |X^(1)|^3), 
+        # and the kink makes the trapezoid rule of each row short by step^2/12 * 2a
+        kink = - np.einsum("ij,ij->i", np.cross(dXYZ, ddXYZ), dddXYZ) / 12 / np.power(np.linalg.norm(dXYZ, axis=1), 3)
+        value = value * step * step + step * np.sum(step*step/12 * 2*kink)
+        # the former quadrature takes Z = \sum zas sin(xn*zeta), the mirror image of the curve of `getRZ`, 
+        # whose writhe has the opposite sign; its sign convention is kept
+        return - value / np.pi / 4
+
+    def getWrithe(self, method: str="grid", tol: float=1e-10, nums: int=64, maxNums: int=4096) -> float:
+        """
+        The writhe of the axis curve. 
+        Args:
+            method: `"grid"` or `"dblquad"`. With `"grid"`, the doubly periodic Gauss integral is summed on a uniform zeta x zeta grid 
+                with the diagonal treated analytically (the error falls as nums**-4), and the grid is doubled from `nums` up to 
+                `maxNums` until two estimates differ by less than `tol`; the last two estimates are then extrapolated. 
+                `"dblquad"` is the former adaptive quadrature. 
+        """
+        if method == "grid":
+            ans, err = self._refineWrithe([self], tol, nums, maxNums)
+            ans, err = ans[0], err[0]
+            print("An estimate of the error is " + str(err) + " ...")
+            print("The writhe of the axis curve is " + str(ans) + " ...")
+            return ans
+        elif method != "dblquad":
+            raise ValueError(
+                "`method` should be `grid` or `dblquad`. "
+            )
         def getRZ(zeta: float) -> Tuple[np.float64]:
             angle = zeta * self.xn.flatten()
             r, z = np.dot(self.rac.flatten(), np.cos(angle)), np.dot(self.zas.flatten(), np.sin(angle))
@@ -109,6 +161,32 @@ class Axis:
         print("The writhe of the axis curve is " + str(ans) + " ...")
         return ans
 
+    @staticmethod
+    def _refineWrithe(axisList: list, tol: float, nums: int, maxNums: int) -> Tuple[np.ndarray]:
+        ansArr = np.full(len(axisList), np.nan)
+        errArr = np.full(len(axisList), np.nan)
+        lastArr = np.array([axis._getWritheGrid(nums) for axis in axisList])
+        todo = np.arange(len(axisList))
+        while len(todo) > 0 and 2*nums <= maxNums:
+            nums = 2 * nums
+            newArr = np.array([axisList[i]._getWritheGrid(nums) for i in todo])
+            errArr[todo] = np.abs(newArr - lastArr[todo])
+            # the error falls as nums**-4, so the Richardson extrapolation removes the leading term
+            ansArr[todo] = newArr + (newArr - lastArr[todo]) / 15
+            lastArr[todo] = newArr
+            todo = todo[errArr[todo] >= tol]
+        if len(todo) > 0:
+            print("The writhe is not converged to " + str(tol) + " with " + str(maxNums) + " points for " + str(len(todo)) + " curves ...")
+        ansArr[np.isnan(ansArr)] = lastArr[np.isnan(ansArr)]
+        return ansArr, errArr
+
+    @classmethod
+    def getWritheMany(cls, axisList: list, tol: float=1e-10, nums: int=64, maxNums: int=4096) -> np.ndarray:
+        """
+        The writhe of many axis curves with the grid method of `getWrithe`, each curve is refined only until it is converged. 
+        """
+        return cls._refineWrithe(list(axisList), tol, nums, maxNums)[0]
+
     @classmethod
     def readH5(cls, fileName: str):
         with h5py.File(fileName, 'r') as f:
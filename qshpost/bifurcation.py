@@ -1,26 +1,69 @@
+import os
 import numpy as np
-from scipy.integrate import solve_ivp 
 from .axis import Axis
 from mpy.specMagneticField import FieldLine, specField
 from mpy.specMagneticField import readJacobian
-from typing import Tuple
+from ._tracing import _iterLines, _fieldFunctions
+from .fixedPoint import _toPlane, _fromPlane
+from ._parallel import parallelMap, splitIndex
+from .gridCache import GridCache
+from typing import Callable, List, Tuple
 
 
-def findBifurcation(firstAxis: Axis, secondAxis: Axis, bField: specField, jacobianData: str, niter: int=10, plotDebug: bool=False, iterLine: int=6) -> Tuple[float]:
+def findBifurcation(firstAxis: Axis, secondAxis: Axis, bField: specField, jacobianData: str, niter: int=10, plotDebug: bool=False, iterLine: int=6, cache: GridCache=None, 
+    nsection: int=1, secant: bool=False, workers: int=None, memo: dict=None, specFile: str=None, **kwargs) -> Tuple[float]:
+    """
+    Search the s on the section zeta = 0 between the two axes where the traced line starts to reach the second axis, 
+    i.e. where `midR(s)`, the largest R of the crossings of the line from s, reaches R of the second axis. 
+    The lines start on the ray theta = theta of `secondAxis.initPoint` (such as the fixed point of `findAxes`, which is not 
+    always at theta = 0). `firstAxis.initPoint` should be on the same ray (or at the coordinate axis s = -1), 
+    otherwise a `ValueError` is raised. 
+    Args:
+        niter: number of rounds, each round narrows the bracket [leftS, rightS]. 
+        nsection: number of candidate s traced per round. With `nsection=1` it is the bisection, otherwise the bracket is cut 
+            into `nsection+1` equal parts. The candidates of a round are traced in parallel by `workers` processes if given, 
+            otherwise one after another. 
+        secant: if `True`, one candidate of each round is the regula falsi (Illinois) estimate from the values of `midR` at the ends 
+            of the bracket, so a smooth `midR(s)` converges superlinearly. The lines are then traced in full to get `midR`, 
+            otherwise a line stops at its first crossing beyond the second axis. 
+        memo: a dict of the traced `midR`, which is read and updated, so repeated searches do not trace the same s again. 
+            It is keyed by s and the options of the trace: the SPEC file (`id(bField)` if it is not known) and the volume of the field, 
+            the ray, `iterLine`, the stop radius and the `repr` of `kwargs` (whose values need not be hashable), 
+            so a memo shared by searches with other fields or options is not misread. 
+        specFile: the SPEC output file of the field, used as the key of `cache` when `bField.specData` does not know it. 
+        kwargs: the options of `traceLine`, such as `integrator` and `continuous`. 
+    returns:
+        leftS, rightS: the final bracket. 
+    """
     
-    if jacobianData is None:
-        base_Jacobian = bField.getB()
+    if cache is not None and jacobianData is None:
+        base_sArr, base_thetaArr, base_zetaArr, base_Jacobian = cache.getGrid(bField, "jacobian", specFile)
+    elif cache is not None:
+        base_sArr, base_thetaArr, base_zetaArr, base_Jacobian = cache.readJacobian(jacobianData)
+    elif jacobianData is None:
+        base_Jacobian = bField.getJacobian()
         base_sArr = bField.sArr
         base_thetaArr = bField.thetaArr
         base_zetaArr = bField.zetaArr
     else:
         base_sArr, base_thetaArr, base_zetaArr, base_Jacobian = readJacobian(jacobianData)
 
-    firstR = float(firstAxis.getRZ(np.array([0]))[0])
-    secondR = float(secondAxis.getRZ(np.array([0]))[0])
+    firstR = float(firstAxis.getRZ(np.array([0]))[0][0])
+    secondR = float(secondAxis.getRZ(np.array([0]))[0][0])
     print("R = " + "{:.2e}".format(firstR) + ", " + "{:.2e}".format(secondR))
     assert firstR < secondR
-    leftS, rightS = firstAxis.initPoint[0], secondAxis.initPoint[0]
+    # the bracket [leftS, rightS] is along the ray of the second axis, and the first axis is taken as its nearest point 
+    # on the ray in the plane (u, v) = sqrt((1+s)/2) * (cos(theta), sin(theta)), which is regular at the coordinate axis
+    rayTheta = float(secondAxis.initPoint[1])
+    rightS = secondAxis.initPoint[0]
+    firstU, firstV = _toPlane(np.float64(firstAxis.initPoint[0]), np.float64(firstAxis.initPoint[1]) - rayTheta)
+    secondU = _toPlane(np.float64(rightS), np.float64(0))[0]
+    leftU = max(float(firstU), 0.0)
+    if np.hypot(firstU-leftU, firstV) > 0.01 * (secondU - leftU):
+        raise ValueError(
+            "The two axes should be on the same ray of theta on the section zeta = 0! "
+        )
+    leftS = _fromPlane(np.float64(leftU), np.float64(0))[0]
     # leftS, rightS = -1, 1
     # leftState, rightState = True, False
 
@@ -28,25 +71,57 @@ def findBifurcation(firstAxis: Axis, secondAxis: Axis, bField: specField, jacobi
         import matplotlib.pyplot as plt
         fig, ax = plt.subplots()
 
-    lineArr = list()
+    import pyoculus
+    pyoculusField = pyoculus.problems.SPECBfield(bField.specData, bField.lvol+1)
+    memo = dict() if memo is None else memo
+    try:
+        fieldKey = (os.path.abspath(GridCache._specFile(bField, specFile)), bField.lvol)
+    except ValueError:
+        fieldKey = (id(bField), bField.lvol)
+    # the search only needs to know whether a crossing reaches `secondR`, unless the values of `midR` are used by the secant step
+    stopR = None if (plotDebug or secant) else secondR
+    traceKey = (fieldKey, rayTheta, iterLine, stopR, repr(sorted(kwargs.items())))
+    # midR - secondR at the ends of the bracket, None if the end is not traced
+    leftF, rightF = firstR - secondR, None
+    lastSide = None
     for _i in range(niter):
-        midS = (leftS + rightS) / 2
-        lineArr.append(traceLine(np.array([midS, 0]), bField, base_sArr, base_thetaArr, base_zetaArr, base_Jacobian, iterLine))
-        rArr = list()
-        zArr = list()
-        for i in range(len(lineArr[-1].rArr)):
-            if i % lineArr[-1].nZeta == 0:
-                rArr.append(lineArr[-1].rArr[i])
-                zArr.append(lineArr[-1].zArr[i])
-        if plotDebug:
-            dots = ax.scatter(rArr, zArr, s=2.0)
-        midR = max(rArr)
-        print("midR = " + "{:.2e}".format(midR))
-        assert midR > firstR
-        if midR < secondR:
-            leftS = midS
-        else:
-            rightS = midS
+        candidates = list(leftS + (rightS - leftS) * np.arange(1, nsection+1) / (nsection+1))
+        if secant and rightF is not None:
+            falseS = (leftS*rightF - rightS*leftF) / (rightF - leftF)
+            width = rightS - leftS
+            candidates[len(candidates)//2] = min(max(falseS, leftS+0.01*width), rightS-0.01*width)
+        candidates = sorted(set(candidates))
+        todo = [midS for midS in candidates if (midS, traceKey) not in memo]
+        if len(todo) > 0:
+            lines = traceLine(
+                np.array([[midS, rayTheta] for midS in todo]), bField, base_sArr, base_thetaArr, base_zetaArr, base_Jacobian, iterLine, 
+                workers=workers, sectionOnly=True, maxR=stopR, pyoculusField=pyoculusField, **kwargs
+            )
+            for midS, line in zip(todo, lines):
+                # every recorded point is a section point, since `nZeta == 1`
+                memo[(midS, traceKey)] = float(np.max(line.rArr))
+                if plotDebug:
+                    dots = ax.scatter(line.rArr, line.zArr, s=2.0)
+        newLeft, newRight = leftS, rightS
+        newLeftF, newRightF = leftF, rightF
+        for midS in candidates:
+            midR = memo[(midS, traceKey)]
+            print("midR = " + "{:.2e}".format(midR))
+            assert midR > firstR
+            if midR < secondR:
+                newLeft, newLeftF = midS, midR - secondR
+            else:
+                newRight, newRightF = midS, midR - secondR
+                break
+        # Illinois modification: halve the value of an end which is kept twice in a row
+        side = "left" if newLeft == leftS else ("right" if newRight == rightS else None)
+        if secant and side is not None and side == lastSide:
+            if side == "left":
+                newLeftF = newLeftF / 2
+            elif newRightF is not None:
+                newRightF = newRightF / 2
+        lastSide = side
+        leftS, rightS, leftF, rightF = newLeft, newRight, newLeftF, newRightF
 
     if plotDebug:
         plt.axis("equal")
@@ -56,35 +131,75 @@ def findBifurcation(firstAxis: Axis, secondAxis: Axis, bField: specField, jacobi
 
 def traceLine(initPoint: np.ndarray, bField: specField, 
     base_sArr: np.ndarray, base_thetaArr: np.ndarray, base_zetaArr: np.ndarray, base_Jacobian: np.ndarray, 
-    iterLine: int, nstep: int=4) -> FieldLine:
+    iterLine: int, nstep: int=4, workers: int=None, continuous: bool=False, sectionOnly: bool=False, 
+    stopOutside: bool=False, maxR: float=None, instrument: bool or Callable=False, 
+    integrator: str="solve_ivp", method: str=None, substep: int=1, pyoculusField=None) -> FieldLine or List[FieldLine]:
+    """
+    Trace the field line(s) from `initPoint` = (s, theta) on the section zeta = 0. 
+    If `initPoint` has the shape (n, 2), a list of lines is returned and `workers` processes can be used to trace them. 
+    If `continuous` is `True`, each line is integrated by one stepper and sampled from its dense output. 
+    If `sectionOnly` is `True`, only the crossings of the section zeta = 0 are recorded, and the lines have `nZeta == 1`. 
+    A line stops before leaving the volume if `stopOutside` is `True`, and at the first crossing with R >= `maxR`; 
+    the `status` attribute of the line is `"finished"`, `"outside"`, `"maxR"` or `"failed"` (see `_tracing.traceLine`). 
+    The lines are traced by `_tracing._iterLines` with the field of `bField` divided by the Jacobian on the `base_*` grid. 
+    If `instrument` is `True`, each line gets a `stats` attribute (`TracingStats`); if it is callable, it is also called 
+    as `instrument(index, stats)` for each line. 
+    `integrator` is `"solve_ivp"` (adaptive, `method` is a scipy solver, LSODA with `rtol=1e-9` by default) or `"fixed"` 
+    (explicit Runge-Kutta with `substep` equal steps per interval, `method` is `"RK4"` by default, see `_tracing.traceLine`); 
+    the fixed-step engine advances all the points together, and the stats are shared by the lines. 
+    `pyoculusField` is the `pyoculus.problems.SPECBfield` of `bField`, built here if it is not given. 
+    """
+    if integrator not in ("solve_ivp", "fixed"):
+        raise ValueError(
+            "`integrator` should be `solve_ivp` or `fixed`. "
+        )
+
+    if np.ndim(initPoint) == 2:
+        if workers is not None and workers > 1:
+            chunks = splitIndex(len(initPoint), workers)
+            results = parallelMap(
+                traceLine, [{"initPoint": initPoint[chunk]} for chunk in chunks], workers, setup=_workerField, 
+                bField=bField, base_sArr=base_sArr, base_thetaArr=base_thetaArr, base_zetaArr=base_zetaArr, base_Jacobian=base_Jacobian, 
+                iterLine=iterLine, nstep=nstep, continuous=continuous, sectionOnly=sectionOnly, 
+                stopOutside=stopOutside, maxR=maxR, instrument=bool(instrument), 
+                integrator=integrator, method=method, substep=substep, pyoculusField=pyoculusField
+            )
+            lines = [line for lines in results for line in lines]
+            if callable(instrument):
+                for index, line in enumerate(lines):
+                    instrument(index, line.stats)
+            return lines
+        pointArr = initPoint
+    else:
+        pointArr = [initPoint]
     
-    import pyoculus
-    pyoculusField = pyoculus.problems.SPECBfield(bField.specData, bField.lvol+1)
-    def getB(zeta, s_theta):
-        field = pyoculusField.B_many(s_theta[0], s_theta[1], zeta) / bField.interpValue(base_Jacobian, s_theta[0], s_theta[1], zeta, sArr=base_sArr, thetaArr=base_thetaArr, zetaArr=base_zetaArr)
-        bSupS = field[0, 0]
-        bSupTheta = field[0, 1]
-        bSupZeta = field[0, 2]
-        return [bSupS/bSupZeta, bSupTheta/bSupZeta]
-    sValue, thetaValue = initPoint
-    s_theta = [sValue, thetaValue]
-    zetaStart = 0
-    dZeta = 2 * np.pi / bField.nfp / nstep
-    sArr = [sValue]
-    thetaArr = [thetaValue]
-    zetaArr = [0]
-    niter = bField.nfp * iterLine
-    for j in range(niter):
-        for k in range(nstep):
-            sol = solve_ivp(getB, (zetaStart,zetaStart+dZeta), s_theta, method="LSODA", rtol=1e-9)
-            sArr.append(sol.y[0,-1])
-            thetaArr.append(sol.y[1,-1])
-            zetaArr.append(zetaStart+dZeta)
-            s_theta = [sArr[-1], thetaArr[-1]]
-            zetaStart = zetaArr[-1]
-    line = FieldLine.getLine_tracing(bField, nstep, np.array(sArr), np.array(thetaArr), np.array(zetaArr))
-    return line
+    pointArr = np.asarray(pointArr, dtype=float)
+    if integrator == "fixed":
+        kwargs = {"method": method or "RK4", "substep": substep}
+    else:
+        kwargs = {"method": method or "LSODA", "rtol": 1e-9}
+    gridData = (base_sArr, base_thetaArr, base_zetaArr, base_Jacobian)
+    lines = [None for _i in range(len(pointArr))]
+    for index, line in _iterLines(
+        bField, "calculate", gridData, pointArr[:, 0], pointArr[:, 1], np.zeros(len(pointArr)), 
+        niter=bField.nfp*iterLine, nstep=nstep, printControl=False, continuous=continuous, sectionOnly=sectionOnly, 
+        stopOutside=stopOutside, maxR=maxR, instrument=bool(instrument), integrator=integrator, 
+        fieldFunctions=_fieldFunctions(bField, "calculate", gridData, pyoculusField), **kwargs
+    ):
+        lines[index] = line
+        if callable(instrument):
+            instrument(int(index), line.stats)
+    if np.ndim(initPoint) == 2:
+        return lines
+    return lines[0]
+
 
+def _workerField(bField: specField, pyoculusField=None, **kwargs) -> dict:
+    # the `SPECBfield` of `bField` shared by the tasks of one worker, built once per worker if it is not given
+    if pyoculusField is None:
+        from pyoculus.problems import SPECBfield
+        pyoculusField = SPECBfield(bField.specData, bField.lvol+1)
+    return {"pyoculusField": pyoculusField}
 
 
 if __name__ == "__main__":
@@ -1,8 +1,11 @@
+import h5py
 import numpy as np 
 import mpy.fitting as fitting
-from scipy.optimize import least_squares
+from scipy.optimize import OptimizeResult
 from mpy.specMagneticField import FieldLine
-from typing import Tuple
+from ._fourier import fitFourier, evalFourier, _warnIgnored
+from ._parallel import parallelMap, splitIndex
+from typing import List, Tuple
 
 
 class FirstCrossSurface:
@@ -23,11 +26,7 @@ class FirstCrossSurface:
         return cls(xm=xm, sSin=coeffSin, sCos=coeffCos)
 
     def getS(self, thetaArr):
-        angleMat = np.dot(self.xm.reshape(-1,1), thetaArr.reshape(1,-1))
-        return (
-            np.dot(self.sSin.reshape(1,-1), np.sin(angleMat)) + 
-            np.dot(self.sCos.reshape(1,-1), np.cos(angleMat))
-        ).flatten()
+        return evalFourier(thetaArr, self.xm, cosCoeff=self.sCos, sinCoeff=self.sSin)
 
 
 class SecondCrossSurface:
@@ -40,7 +39,12 @@ class SecondCrossSurface:
         self.thetaCos = thetaCos
 
     @classmethod
-    def fitSecondCross(cls, line: FieldLine, mpol: int=12, **kwargs):
+    def fitSecondCross(cls, line: FieldLine, mpol: int=12, order: str="kdtree", **kwargs):
+        """
+        Fit s and theta of the section points of the upper half (z >= 0) and their mirror image against the normalized arc length. 
+        Args:
+            order: the ordering of the section points along the curve, see `_orderSection`. 
+        """
         rArr, zArr, sArr, thetaArr = list(), list(), list(), list()
         for i in range(len(line.rArr)):
             if i % line.nZeta == 0 and line.zArr[i] >= 0:
@@ -52,58 +56,148 @@ class SecondCrossSurface:
         zArr = np.array(zArr)
         sArr = np.array(sArr)
         thetaArr = np.array(thetaArr)
-        nums = rArr.size
-        pointState = [False for _i in range(nums)]
-        pointIndex = 0
-        pointState[pointIndex]= True
-        _rArr, _zArr, _sArr, _thetaArr = [rArr[pointIndex]], [zArr[pointIndex]], [sArr[pointIndex]], [thetaArr[pointIndex]]
-        for i in range(nums):
-            minDistance = 1e10
-            _index = pointIndex
-            for j in range(nums):
-                if pointState[j] == False:
-                    distance = np.power(rArr[pointIndex]-rArr[j],2) +  np.power(zArr[pointIndex]-zArr[j],2)
-                    if distance < minDistance:
-                        minDistance = distance
-                        _index = j
-            pointIndex = _index
-            pointState[pointIndex]= True
-            _rArr.append(rArr[pointIndex])
-            _zArr.append(zArr[pointIndex])
-            _sArr.append(sArr[pointIndex])
-            _thetaArr.append(thetaArr[pointIndex])
-        for i in range(nums):
-            _rArr.append(_rArr[nums-1-i])
-            _zArr.append(-_zArr[nums-1-i])
-            _sArr.append(_sArr[nums-1-i])
-            _thetaArr.append(-_thetaArr[nums-1-i])
-        sArr = np.array(_sArr)
-        _thetaArr = np.array(_thetaArr) % (2*np.pi)
+        index = _orderSection(rArr, zArr, order)
+        # the upper half in order, then its mirror image (z -> -z, theta -> -theta) backwards
+        _rArr = np.concatenate((rArr[index], rArr[index[-2::-1]]))
+        _zArr = np.concatenate((zArr[index], -zArr[index[-2::-1]]))
+        sArr = np.concatenate((sArr[index], sArr[index[-2::-1]]))
+        _thetaArr = np.concatenate((thetaArr[index], -thetaArr[index[-2::-1]])) % (2*np.pi)
         thetaArr = np.where(_thetaArr<np.pi, _thetaArr, _thetaArr-(2*np.pi))
-        disArr = np.zeros(len(_rArr))
-        for i in range(len(_rArr)-1):
-            disArr[i+1] = np.power(np.power(_rArr[i+1]-_rArr[i],2)+np.power(_zArr[i+1]-_zArr[i],2), 0.5)
-        sumDis = np.cumsum(disArr)
-        labelArr = 2*np.pi*sumDis/sumDis[-1]
+        labelArr = _arcLabel(_rArr, _zArr)
         xm, thetaSin, thetaCos = fitting.fitPeriodicCurve(np.array(labelArr), np.array(thetaArr), mpol)
         xm, sSin, sCos = fitting.fitPeriodicCurve(np.array(labelArr), np.array(sArr), mpol)
         return cls(xm=xm, sSin=sSin, sCos=sCos, thetaSin=thetaSin, thetaCos=thetaCos)
 
     def getS(self, labelArr):
-        angleMat = np.dot(self.xm.reshape(-1,1), labelArr.reshape(1,-1))
-        return (
-            np.dot(self.sSin.reshape(1,-1), np.sin(angleMat)) + 
-            np.dot(self.sCos.reshape(1,-1), np.cos(angleMat))
-        ).flatten()
+        return evalFourier(labelArr, self.xm, cosCoeff=self.sCos, sinCoeff=self.sSin)
 
     def getTheta(self, labelArr):
-        angleMat = np.dot(self.xm.reshape(-1,1), labelArr.reshape(1,-1))
-        return (
-            np.dot(self.thetaSin.reshape(1,-1), np.sin(angleMat)) + 
-            np.dot(self.thetaCos.reshape(1,-1), np.cos(angleMat))
-        ).flatten()
+        return evalFourier(labelArr, self.xm, cosCoeff=self.thetaCos, sinCoeff=self.thetaSin)
+
+    def getSTheta(self, labelArr, derivative: int=0) -> Tuple[np.ndarray]:
+        """
+        s and theta (or their derivatives in the label) on the same labels, evaluated together. 
+        """
+        sTheta = evalFourier(
+            labelArr, self.xm, 
+            cosCoeff=np.stack((self.sCos, self.thetaCos), axis=1), sinCoeff=np.stack((self.sSin, self.thetaSin), axis=1), 
+            derivative=derivative
+        )
+        return sTheta[:, 0], sTheta[:, 1]
+
+
+class CrossSurfaceFamily:
+    """
+    The fits of a family of (nested) cross surfaces, stored as arrays with the shape (nSurface, nMode). 
+    `kind` is `"first"` (s as a function of theta, as `FirstCrossSurface`) or `"second"` (s and theta as functions of the 
+    arc-length label, as `SecondCrossSurface`). 
+    """
+
+    def __init__(self, kind: str, xm: np.ndarray, sSin: np.ndarray, sCos: np.ndarray, thetaSin: np.ndarray=None, thetaCos: np.ndarray=None) -> None:
+        if kind not in ("first", "second"):
+            raise ValueError(
+                "`kind` should be `first` or `second`. "
+            )
+        self.kind = kind
+        self.xm = np.asarray(xm)
+        self.sSin = np.atleast_2d(sSin)
+        self.sCos = np.atleast_2d(sCos)
+        self.thetaSin = None if thetaSin is None else np.atleast_2d(thetaSin)
+        self.thetaCos = None if thetaCos is None else np.atleast_2d(thetaCos)
+        self.len = self.sSin.shape[0]
+
+    def __len__(self) -> int:
+        return self.len
+
+    @classmethod
+    def fromSurfaces(cls, surfaceList: List[FirstCrossSurface] or List[SecondCrossSurface]):
+        if all(isinstance(surface, FirstCrossSurface) for surface in surfaceList):
+            return cls(
+                "first", surfaceList[0].xm, 
+                np.stack([surface.sSin for surface in surfaceList]), np.stack([surface.sCos for surface in surfaceList])
+            )
+        elif all(isinstance(surface, SecondCrossSurface) for surface in surfaceList):
+            return cls(
+                "second", surfaceList[0].xm, 
+                np.stack([surface.sSin for surface in surfaceList]), np.stack([surface.sCos for surface in surfaceList]), 
+                np.stack([surface.thetaSin for surface in surfaceList]), np.stack([surface.thetaCos for surface in surfaceList])
+            )
+        raise TypeError(
+            "The surfaces should be all `FirstCrossSurface` or all `SecondCrossSurface`! "
+        )
+
+    @classmethod
+    def fitLines(cls, lineList: List[FieldLine], kind: str="first", mpol: int=12, workers: int=None, **kwargs):
+        """
+        Fit each line with `FirstCrossSurface.fitFirstCross` or `SecondCrossSurface.fitSecondCross`. 
+        Args:
+            workers: number of processes, the lines are split into contiguous chunks. 
+            kwargs: the options of the fit, such as `order`. 
+        """
+        if workers is not None and workers > 1:
+            chunks = splitIndex(len(lineList), workers)
+            results = parallelMap(
+                _fitLines, [{"lineList": [lineList[i] for i in chunk]} for chunk in chunks], workers, kind=kind, mpol=mpol, **kwargs
+            )
+            surfaceList = [surface for surfaces in results for surface in surfaces]
+        else:
+            surfaceList = _fitLines(lineList, kind, mpol, **kwargs)
+        return cls.fromSurfaces(surfaceList)
+
+    def getSurface(self, index: int) -> FirstCrossSurface or SecondCrossSurface:
+        if self.kind == "first":
+            return FirstCrossSurface(xm=self.xm, sSin=self.sSin[index], sCos=self.sCos[index])
+        return SecondCrossSurface(xm=self.xm, sSin=self.sSin[index], sCos=self.sCos[index], thetaSin=self.thetaSin[index], thetaCos=self.thetaCos[index])
+
+    def getS(self, labelArr: np.ndarray, derivative: int=0) -> np.ndarray:
+        """
+        returns:
+            s of every surface at `labelArr` (theta for `"first"`), with the shape (nSurface, len(labelArr)). 
+        """
+        return evalFourier(labelArr, self.xm, cosCoeff=self.sCos.T, sinCoeff=self.sSin.T, derivative=derivative).T
+
+    def getTheta(self, labelArr: np.ndarray, derivative: int=0) -> np.ndarray:
+        """
+        returns:
+            theta of every surface at `labelArr`, with the shape (nSurface, len(labelArr)). For `"first"` it is the label itself. 
+        """
+        if self.kind == "first":
+            labelArr = np.asarray(labelArr, dtype=float).flatten()
+            value = labelArr if derivative == 0 else (np.ones_like(labelArr) if derivative == 1 else np.zeros_like(labelArr))
+            return np.tile(value, (self.len, 1))
+        return evalFourier(labelArr, self.xm, cosCoeff=self.thetaCos.T, sinCoeff=self.thetaSin.T, derivative=derivative).T
+
+    @classmethod
+    def readH5(cls, fileName: str):
+        with h5py.File(fileName, 'r') as f:
+            kind = str(f.attrs["kind"])
+            xm = f["xm"][:]
+            sSin = f["sSin"][:]
+            sCos = f["sCos"][:]
+            thetaSin = f["thetaSin"][:] if "thetaSin" in f else None
+            thetaCos = f["thetaCos"][:] if "thetaCos" in f else None
+        return cls(kind, xm=xm, sSin=sSin, sCos=sCos, thetaSin=thetaSin, thetaCos=thetaCos)
+
+    def writeH5(self, fileName: str):
+        with h5py.File(fileName, 'w') as f:
+            f.attrs["kind"] = self.kind
+            f.create_dataset("xm", data=self.xm)
+            f.create_dataset("sSin", data=self.sSin)
+            f.create_dataset("sCos", data=self.sCos)
+            if self.kind == "second":
+                f.create_dataset("thetaSin", data=self.thetaSin)
+                f.create_dataset("thetaCos", data=self.thetaCos)
 
 
+def _fitLines(lineList: List[FieldLine], kind: str, mpol: int, **kwargs) -> List[FirstCrossSurface] or List[SecondCrossSurface]:
+    if kind == "first":
+        return [FirstCrossSurface.fitFirstCross(line, mpol, **kwargs) for line in lineList]
+    elif kind == "second":
+        return [SecondCrossSurface.fitSecondCross(line, mpol, **kwargs) for line in lineList]
+    raise ValueError(
+        "`kind` should be `first` or `second`. "
+    )
+
 
 # Old Codes #########################################################################################################################################
 class OldCrossSurface:
@@ -128,7 +222,7 @@ class OldCrossSurface:
         return cls(xm=xm, rc=rc, rs=np.zeros(len(xm)), zc=np.zeros(len(xm)), zs=zs)
 
     @classmethod
-    def fitSecondCross(cls, line: FieldLine, mpol: int, **kwargs):
+    def fitSecondCross(cls, line: FieldLine, mpol: int, order: str="kdtree", **kwargs):
         rArr, zArr = list(), list()
         for i in range(len(line.rArr)):
             if i % line.nZeta == 0 and line.zArr[i] >= 0:
@@ -136,32 +230,10 @@ class OldCrossSurface:
                 zArr.append(line.zArr[i])
         rArr = np.array(rArr)
         zArr = np.array(zArr)
-        nums = rArr.size
-        pointState = [False for _i in range(nums)]
-        pointIndex = 0
-        pointState[pointIndex]= True
-        _rArr, _zArr = [rArr[pointIndex]], [zArr[pointIndex]]
-        for i in range(nums):
-            minDistance = 1e10
-            _index = pointIndex
-            for j in range(nums):
-                if pointState[j] == False:
-                    distance = np.power(rArr[pointIndex]-rArr[j],2) +  np.power(zArr[pointIndex]-zArr[j],2)
-                    if distance < minDistance:
-                        minDistance = distance
-                        _index = j
-            pointIndex = _index
-            pointState[pointIndex]= True
-            _rArr.append(rArr[pointIndex])
-            _zArr.append(zArr[pointIndex])
-        for i in range(nums):
-            _rArr.append(_rArr[nums-1-i])
-            _zArr.append(-_zArr[nums-1-i])
-        disArr = np.zeros(len(_rArr))
-        for i in range(len(_rArr)-1):
-            disArr[i+1] = np.power(np.power(_rArr[i+1]-_rArr[i],2)+np.power(_zArr[i+1]-_zArr[i],2), 0.5)
-        sumDis = np.cumsum(disArr)
-        _thetaArr = 2*np.pi*sumDis/sumDis[-1]
+        index = _orderSection(rArr, zArr, order)
+        _rArr = np.concatenate((rArr[index], rArr[index[-2::-1]]))
+        _zArr = np.concatenate((zArr[index], -zArr[index[-2::-1]]))
+        _thetaArr = _arcLabel(_rArr, _zArr)
         xm, rc = fitPeriodicR(_thetaArr, np.array(_rArr), mpol)
         xm, zs = fitPeriodicZ(_thetaArr, np.array(_zArr), mpol) 
         return cls(xm=xm, rc=rc, rs=np.zeros(len(xm)), zc=np.zeros(len(xm)), zs=zs)
@@ -179,82 +251,108 @@ class OldCrossSurface:
         return cls(xm=xm, rc=rc, rs=rs, zc=zc, zs=zs)
 
     def getRZ(self, theta: np.ndarray) -> Tuple[np.ndarray]: 
-        angleMat = np.dot(self.xm.reshape(-1,1), theta.reshape(1,-1))
-        rArr = (
-            np.dot(self.rc.reshape(1,-1), np.cos(angleMat)) + 
-            np.dot(self.rs.reshape(1,-1), np.sin(angleMat))
-        ).flatten()
-        zArr = (
-            np.dot(self.zc.reshape(1,-1), np.cos(angleMat)) + 
-            np.dot(self.zs.reshape(1,-1), np.sin(angleMat))
-        ).flatten()
-        return rArr, zArr
+        rz = evalFourier(
+            theta, self.xm, cosCoeff=np.stack((self.rc, self.zc), axis=1), sinCoeff=np.stack((self.rs, self.zs), axis=1)
+        )
+        return rz[:, 0], rz[:, 1]
+
+
+def _orderSection(rArr: np.ndarray, zArr: np.ndarray, order: str="kdtree") -> np.ndarray:
+    """
+    The order of the section points along the curve. 
+    Args:
+        order: `"kdtree"`, the greedy nearest-neighbour walk from the first point (the former ordering), with the neighbours found 
+            by a KD-tree; or `"angle"`, the sort by the angle about the centre (mean R, 0) of the mirrored section, from the point 
+            with the smallest angle, for the curves which are star-shaped about it. 
+    returns:
+        the indices of the points in order, the last one repeated as in the former walk. 
+    """
+    nums = rArr.size
+    if order == "angle":
+        index = np.argsort(np.arctan2(zArr, rArr-np.mean(rArr)), kind="stable")
+    elif order == "kdtree":
+        from scipy.spatial import cKDTree
+        points = np.stack((rArr, zArr), axis=1)
+        tree = cKDTree(points)
+        visited = np.zeros(nums, dtype=bool)
+        index = np.empty(nums, dtype=int)
+        pointIndex = 0
+        visited[pointIndex] = True
+        index[0] = pointIndex
+        for i in range(1, nums):
+            k = min(8, nums)
+            while True:
+                _dis, neighbour = tree.query(points[pointIndex], k=k)
+                neighbour = np.atleast_1d(neighbour)
+                neighbour = neighbour[neighbour < nums]
+                free = neighbour[~visited[neighbour]]
+                if free.size > 0 or k == nums:
+                    break
+                k = min(2*k, nums)
+            pointIndex = free[0]
+            visited[pointIndex] = True
+            index[i] = pointIndex
+    else:
+        raise ValueError(
+            "`order` should be `kdtree` or `angle`. "
+        )
+    return np.append(index, index[-1])
+
+
+def _arcLabel(rArr: np.ndarray, zArr: np.ndarray) -> np.ndarray:
+    # the cumulative arc length of the polygon, normalized to [0, 2*pi]
+    sumDis = np.concatenate(([0], np.cumsum(np.hypot(np.diff(rArr), np.diff(zArr)))))
+    return 2*np.pi*sumDis/sumDis[-1]
 
 
 def fitPeriodicR(thetaArr: np.ndarray, rArr: np.ndarray, mpol: int, debug: bool=False, **kwargs) -> Tuple[np.ndarray]:
     """
-    Use the least squares method to fit the periodic curve! 
+    Use the linear least squares method to fit the periodic curve! 
         r = \sum(rc*cos(xm*theta))
+    `rArr` can have the shape (nums, nCurve) to fit several curves on the same `thetaArr` at once. 
+    Uniform samples over whole periods are fitted by FFT (see `_fourier.fitFourier`). 
+    Options of the former nonlinear solver (`kwargs`, such as `verbose`) have no effect here, and a warning lists them. 
     return:
-        xm, rc 
+        xm, rc; with `debug=True`, the `OptimizeResult` of the fit (`x` is rc, `fun` the residuals, `cost` half their squared sum)
     """
 
-    assert thetaArr.shape == rArr.shape
+    assert thetaArr.shape[0] == rArr.shape[0]
     assert (mpol+1) < thetaArr.size
-    # `verbose = 1`: display a termination report.(0: work silently; 2: display progress during iterations (not supported by 'lm' method))
-    if kwargs.get("verbose") is None:
-        kwargs.update({"verbose": 1}) 
+    _warnIgnored(kwargs)
     xm = np.arange(mpol+1)
-    
-    def getS(rc: np.ndarray, thetaArr: np.ndarray) -> np.ndarray:
-        angleMat = np.dot(xm.reshape(-1,1), thetaArr.reshape(1,-1))
-        return (
-            np.dot(rc.reshape(1,-1), np.cos(angleMat))
-        ).flatten()
-    
-    def getErr(rc: np.ndarray, angleArr: np.ndarray, s: np.ndarray) -> np.ndarray:
-        return s - getS(rc, angleArr)
-    
-    optimizeRes = least_squares(getErr, np.zeros(mpol+1), args=(thetaArr, rArr), bounds=(-np.inf, np.inf), **kwargs)
-
+    rc, _rs = fitFourier(thetaArr, rArr, xm, kind="cos", fft=not debug)
     if debug:
-        return optimizeRes
-    else:
-        assert optimizeRes.success
-        return xm, optimizeRes.x[:]
+        return _fitResult(rc, rArr - evalFourier(thetaArr, xm, cosCoeff=rc))
+    return xm, rc
 
 
 def fitPeriodicZ(thetaArr: np.ndarray, zArr: np.ndarray, mpol: int, debug: bool=False, **kwargs) -> Tuple[np.ndarray]:
     """
-    Use the least squares method to fit the periodic curve! 
-        z = \sum(rc*cos(xm*theta))
+    Use the linear least squares method to fit the periodic curve! 
+        z = \sum(zs*sin(xm*theta))
+    `zArr` can have the shape (nums, nCurve) to fit several curves on the same `thetaArr` at once. 
+    Uniform samples over whole periods are fitted by FFT (see `_fourier.fitFourier`). 
+    Unknown `kwargs` are warned about, as in `fitPeriodicR`. 
     return:
-        xm, zs 
+        xm, zs; with `debug=True`, the `OptimizeResult` of the fit (`x` is zs) 
     """
 
-    assert thetaArr.shape == zArr.shape
+    assert thetaArr.shape[0] == zArr.shape[0]
     assert (mpol+1) < thetaArr.size
-    # `verbose = 1`: display a termination report.(0: work silently; 2: display progress during iterations (not supported by 'lm' method))
-    if kwargs.get("verbose") is None:
-        kwargs.update({"verbose": 1}) 
+    _warnIgnored(kwargs)
     xm = np.arange(mpol+1)
-    
-    def getS(zs: np.ndarray, thetaArr: np.ndarray) -> np.ndarray:
-        angleMat = np.dot(xm.reshape(-1,1), thetaArr.reshape(1,-1))
-        return (
-            np.dot(zs.reshape(1,-1), np.sin(angleMat))
-        ).flatten()
-    
-    def getErr(zs: np.ndarray, angleArr: np.ndarray, s: np.ndarray) -> np.ndarray:
-        return s - getS(zs, angleArr)
-    
-    optimizeRes = least_squares(getErr, np.zeros(mpol+1), args=(thetaArr, zArr), bounds=(-np.inf, np.inf), **kwargs)
-
+    _zc, zs = fitFourier(thetaArr, zArr, xm, kind="sin", fft=not debug)
     if debug:
-        return optimizeRes
-    else:
-        assert optimizeRes.success
-        return xm, optimizeRes.x[:]
+        return _fitResult(zs, zArr - evalFourier(thetaArr, xm, sinCoeff=zs))
+    return xm, zs
+
+
+def _fitResult(coeff: np.ndarray, residual: np.ndarray) -> OptimizeResult:
+    # the fields of the `least_squares` result read by the former debug callers
+    return OptimizeResult(
+        x=coeff, fun=residual, cost=0.5*float(np.sum(residual*residual)), success=True, status=1, 
+        message="The linear least squares solution.", nfev=1
+    )
 
 
 if __name__ == "__main__":
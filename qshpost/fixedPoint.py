@@ -0,0 +1,118 @@
+import numpy as np
+from mpy.specMagneticField import SPECField, FieldLine
+from .axis import Axis
+from .gridCache import GridCache
+from ._integrate import restartSamples
+from ._tracing import getGridData, _fieldFunctions
+from typing import Callable, Tuple
+
+
+def _toPlane(sArr: np.ndarray, thetaArr: np.ndarray) -> Tuple[np.ndarray]:
+    # (u, v) = rho * (cos(theta), sin(theta)) with rho = sqrt((1+s)/2), which is regular at the coordinate axis s = -1
+    rho = np.sqrt(np.maximum(1+sArr, 0) / 2)
+    return rho*np.cos(thetaArr), rho*np.sin(thetaArr)
+
+
+def _fromPlane(uArr: np.ndarray, vArr: np.ndarray) -> Tuple[np.ndarray]:
+    return 2*(uArr*uArr+vArr*vArr) - 1, np.arctan2(vArr, uArr)
+
+
+def _tangentFunction(getB_many: Callable, epsilon: float) -> Callable:
+    # the right-hand side of the state [u, v, M_uu, M_vu, M_uv, M_vv], where M = d(u, v)/d(u0, v0) is the tangent map,
+    # dM/dzeta = A M, and A = d(du/dzeta, dv/dzeta)/d(u, v) is the central difference with the step `epsilon`
+    shift = epsilon * np.array([[0, 0], [1, 0], [-1, 0], [0, 1], [0, -1]])
+
+    def getPlaneB(zeta, uArr, vArr):
+        sArr, thetaArr = _fromPlane(uArr, vArr)
+        dState = getB_many(zeta, np.stack((sArr, thetaArr), axis=1).flatten())
+        dS, dTheta = dState[0::2], dState[1::2]
+        rho = np.sqrt(uArr*uArr+vArr*vArr)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            dRho = dS / 4 / rho
+        return dRho*np.cos(thetaArr) - rho*np.sin(thetaArr)*dTheta, dRho*np.sin(thetaArr) + rho*np.cos(thetaArr)*dTheta
+
+    def fun(zeta, state):
+        points = state[0:2] + shift
+        dU, dV = getPlaneB(zeta, points[:, 0], points[:, 1])
+        dPoint = np.stack((dU, dV), axis=1)
+        # at the coordinate axis itself the field is the mean of the stencil, which is regular
+        center = dPoint[0] if np.all(np.isfinite(dPoint[0])) else np.mean(dPoint[1:], axis=0)
+        jacobian = np.stack(((dPoint[1]-dPoint[2]) / 2 / epsilon, (dPoint[3]-dPoint[4]) / 2 / epsilon), axis=1)
+        tangent = state[2:6].reshape(2, 2, order="F")
+        return np.concatenate((center, (jacobian @ tangent).flatten(order="F")))
+
+    return fun
+
+
+def findAxis(
+    bField: SPECField, ntor: int, s0: float, theta0: float, zeta0: float=0.0,
+    nstep: int=32, tol: float=1e-10, maxIter: int=20, epsilon: float=1e-6,
+    bMethod: str="calculate", bData: str=None, jacobianData: str=None, cache: GridCache=None, specFile: str=None,
+    printControl: bool=True, **kwargs
+) -> Axis:
+    """
+    Find the magnetic axis as the fixed point of the map of one field period (zeta0 -> zeta0 + 2*pi/nfp) by the Newton iteration,
+    starting from (s0, theta0). The Jacobian of the map is the tangent map, integrated along with the line, so each iteration
+    traces one field period. The unknowns are (u, v) = sqrt((1+s)/2) * (cos(theta), sin(theta)), which are regular at the
+    coordinate axis s = -1, so the axis of the innermost volume is found as well (start it at `s0=-1`).
+    The closed orbit of the last iteration is then fitted as in `Axis.traceLine`.
+    Args:
+        ntor: number of toroidal harmonics of the axis.
+        nstep: number of samples of the orbit over one field period.
+        tol: the iteration stops when the fixed point moves less than `tol` in (u, v).
+        epsilon: the step of the central differences of the field in the tangent equations.
+        kwargs: the options of the solver (as `restartSamples`), LSODA with `rtol=1e-10` and `atol=1e-12` by default.
+    returns:
+        the axis, `initPoint` is the fixed point (s, theta, zeta0).
+    """
+    if kwargs.get("method") is None:
+        kwargs.update({"method": "LSODA"})
+    if kwargs.get("rtol") is None:
+        kwargs.update({"rtol": 1e-10})
+    if kwargs.get("atol") is None:
+        kwargs.update({"atol": 1e-12})
+    gridData = getGridData(bField, bMethod, bData, jacobianData, cache, specFile)
+    fun = _tangentFunction(_fieldFunctions(bField, bMethod, gridData)[1], epsilon)
+    dZeta = 2 * np.pi / bField.nfp / nstep
+    point = np.array(_toPlane(np.float64(s0), np.float64(theta0)))
+    for k in range(maxIter+1):
+        state = np.concatenate((point, np.eye(2).flatten(order="F")))
+        orbit = [point]
+        for _zeta, state in restartSamples(fun, zeta0, dZeta, nstep, state, **kwargs):
+            orbit.append(state[0:2])
+        orbit = np.array(orbit)
+        residual = orbit[-1] - point
+        tangent = state[2:6].reshape(2, 2, order="F")
+        if printControl:
+            print("Newton iteration " + str(k) + ": |P(x) - x| = " + "{:.2e}".format(np.linalg.norm(residual)))
+        if np.linalg.norm(residual) < tol:
+            break
+        if k == maxIter:
+            print("The Newton iteration is not converged to " + str(tol) + " in " + str(maxIter) + " iterations ...")
+            break
+        point = point - np.linalg.solve(tangent - np.eye(2), residual)
+    sArr, thetaArr = _fromPlane(orbit[:-1, 0], orbit[:-1, 1])
+    line = FieldLine.getLine_tracing(bField, nstep, sArr, thetaArr, zeta0 + dZeta*np.arange(nstep))
+    return Axis.traceLine(ntor, line, bField.specData)
+
+
+def findAxes(
+    bField: SPECField, ntor: int, secondPoint: Tuple[float], firstPoint: Tuple[float]=(-1.0, 0.0), **kwargs
+) -> Tuple[Axis]:
+    """
+    The two axes of a QSH state by `findAxis`, in the order of the arguments of `findBifurcation`.
+    Args:
+        secondPoint: (s, theta) on the section zeta = 0 near the second axis.
+        firstPoint: (s, theta) on the section zeta = 0 near the first axis, the coordinate axis by default.
+        kwargs: the options of `findAxis`.
+    returns:
+        firstAxis, secondAxis: `findBifurcation` searches along the ray theta of the fixed point of `secondAxis`, 
+            which is wherever the iteration converges, not always theta = 0.
+    """
+    firstAxis = findAxis(bField, ntor, firstPoint[0], firstPoint[1], 0.0, **kwargs)
+    secondAxis = findAxis(bField, ntor, secondPoint[0], secondPoint[1], 0.0, **kwargs)
+    return firstAxis, secondAxis
+
+
+if __name__ == "__main__":
+    pass
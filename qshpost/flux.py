@@ -4,10 +4,22 @@ import mpy.specMagneticField as specMagneticField
 from scipy.integrate import quad
 from pyoculus.problems import SPECBfield
 # from mpy.specMagneticField import FieldLine
-from .crossSurface import FirstCrossSurface, SecondCrossSurface
+from .crossSurface import FirstCrossSurface, SecondCrossSurface, CrossSurfaceFamily
+from ._integrate import periodicTrapezoid
+from typing import List
 
 
-def getFirstFlux(bField: specMagneticField.SPECField, crossSurf: FirstCrossSurface) -> float: 
+def getFirstFlux(bField: specMagneticField.SPECField, crossSurf: FirstCrossSurface, method: str="quad", tol: float=1e-10, nums: int=64, maxNums: int=65536) -> float: 
+    """
+    Args:
+        method: `"quad"` (the adaptive quadrature, by default) or `"trapezoid"` (see `getFluxProfile`, much cheaper). 
+    """
+    if method == "trapezoid":
+        return float(getFluxProfile(bField, [crossSurf], tol=tol, nums=nums, maxNums=maxNums)[0])
+    elif method != "quad":
+        raise ValueError(
+            "`method` should be `trapezoid` or `quad`. "
+        )
     
     pyoculusField = SPECBfield(bField.specData, bField.lvol+1)
     def getPotential(theta):
@@ -17,7 +29,17 @@ def getFirstFlux(bField: specMagneticField.SPECField, crossSurf: FirstCrossSurfa
     return res[0]
 
 
-def getSecondFlux(bField: specMagneticField.SPECField, crossSurf: SecondCrossSurface) -> float: 
+def getSecondFlux(bField: specMagneticField.SPECField, crossSurf: SecondCrossSurface, method: str="quad", tol: float=1e-10, nums: int=64, maxNums: int=65536) -> float: 
+    """
+    Args:
+        method: `"quad"` (the adaptive quadrature, by default) or `"trapezoid"` (see `getFluxProfile`, much cheaper). 
+    """
+    if method == "trapezoid":
+        return float(getFluxProfile(bField, [crossSurf], tol=tol, nums=nums, maxNums=maxNums)[0])
+    elif method != "quad":
+        raise ValueError(
+            "`method` should be `trapezoid` or `quad`. "
+        )
 
     pyoculusField = SPECBfield(bField.specData, bField.lvol+1)
     def getPotential(label):
@@ -25,7 +47,7 @@ def getSecondFlux(bField: specMagneticField.SPECField, crossSurf: SecondCrossSur
     
     def dTheta(label):
         deltaLabel = 1e-8
-        return (crossSurf.getTheta(np.array([label+deltaLabel]))-crossSurf.getTheta(np.array([label-deltaLabel]))) / deltaLabel / 2
+        return (crossSurf.getTheta(np.array([label+deltaLabel]))[0]-crossSurf.getTheta(np.array([label-deltaLabel]))[0]) / deltaLabel / 2
 
     def getValue(label):
         return dTheta(label) * getPotential(label)
@@ -34,5 +56,29 @@ def getSecondFlux(bField: specMagneticField.SPECField, crossSurf: SecondCrossSur
     return res[0]
 
 
+def getFluxProfile(
+    bField: specMagneticField.SPECField, 
+    family: CrossSurfaceFamily or List[FirstCrossSurface] or List[SecondCrossSurface], 
+    tol: float=1e-10, nums: int=64, maxNums: int=65536
+) -> np.ndarray:
+    """
+    The flux through every cross surface of a family, by the trapezoidal rule of the periodic integrand 
+        A(s(label), theta(label), 0)[0] * dtheta/dlabel 
+    which is spectrally accurate. The vector potential is evaluated for all the surfaces in one call, dtheta/dlabel is 
+    analytic from the Fourier coefficients, and the points are doubled (reusing the former ones) from `nums` up to `maxNums` 
+    until two estimates differ by less than `tol` (relative to the flux if it is larger than 1). 
+    returns:
+        the flux of each surface. 
+    """
+    if not isinstance(family, CrossSurfaceFamily):
+        family = CrossSurfaceFamily.fromSurfaces(list(family))
+    pyoculusField = SPECBfield(bField.specData, bField.lvol+1)
+    def getValue(labelArr):
+        sArr, thetaArr = family.getS(labelArr), family.getTheta(labelArr)
+        potential = pyoculusField.vectorPotential([sArr.flatten(), thetaArr.flatten(), np.zeros(sArr.size)])[0]
+        return np.reshape(potential, sArr.shape) * family.getTheta(labelArr, derivative=1)
+    return periodicTrapezoid(getValue, tol, nums, maxNums)
+
+
 if __name__ == "__main__": 
     pass
@@ -0,0 +1,139 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import numpy as np
+from mpy.specMagneticField import SPECField
+from mpy.specMagneticField import readJacobian, readB
+from typing import Callable, Tuple
+
+
+class GridCache:
+    """
+    On-disk store of the grids (Jacobian, metric, B) of SPEC fields.
+    An entry is keyed by the content hash of the SPEC output file, `lvol` and the (s, theta, zeta) resolution,
+    and it is kept as `.npy` files which are loaded as read-only memory maps, so repeated runs and parallel workers
+    share the pages instead of copying them. The least recently used entries are removed when the store exceeds `maxBytes`.
+    """
+
+    _hashMemo = dict()
+
+    def __init__(self, directory: str, maxBytes: int=8*1024**3) -> None:
+        self.directory = directory
+        self.maxBytes = maxBytes
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def hashFile(cls, fileName: str) -> str:
+        """
+        The SHA-256 of the content of a file, memoized on (path, size, mtime).
+        """
+        stat = os.stat(fileName)
+        memoKey = (os.path.abspath(fileName), stat.st_size, stat.st_mtime_ns)
+        if memoKey not in cls._hashMemo:
+            sha = hashlib.sha256()
+            with open(fileName, "rb") as f:
+                for block in iter(lambda: f.read(1024*1024), b""):
+                    sha.update(block)
+            cls._hashMemo[memoKey] = sha.hexdigest()
+        return cls._hashMemo[memoKey]
+
+    @staticmethod
+    def _specFile(bField: SPECField, specFile: str=None) -> str:
+        if specFile is not None:
+            return specFile
+        for name in ("filename", "fileName", "file_name"):
+            if isinstance(getattr(bField.specData, name, None), str):
+                return getattr(bField.specData, name)
+        raise ValueError(
+            "Cannot find the SPEC output file of the field, please give it by `specFile`! "
+        )
+
+    def _entryDir(self, *keyParts) -> str:
+        key = hashlib.sha256(repr(keyParts).encode()).hexdigest()[0:32]
+        return os.path.join(self.directory, key)
+
+    def load(self, *keyParts) -> Tuple[np.ndarray] or None:
+        entryDir = self._entryDir(*keyParts)
+        if not os.path.isdir(entryDir):
+            return None
+        nums = len([file for file in os.listdir(entryDir) if file.endswith(".npy")])
+        arrays = tuple(np.load(os.path.join(entryDir, str(i)+".npy"), mmap_mode="r") for i in range(nums))
+        os.utime(entryDir)          # mark as recently used
+        return arrays
+
+    def store(self, arrays: Tuple[np.ndarray], *keyParts) -> Tuple[np.ndarray]:
+        entryDir = self._entryDir(*keyParts)
+        tempDir = tempfile.mkdtemp(prefix=".tmp-", dir=self.directory)
+        for i, array in enumerate(arrays):
+            np.save(os.path.join(tempDir, str(i)+".npy"), np.asarray(array))
+        try:
+            os.rename(tempDir, entryDir)
+        except OSError:             # written by another process in the meantime
+            shutil.rmtree(tempDir, ignore_errors=True)
+        self.evict(keep=entryDir)
+        return self.load(*keyParts)
+
+    def getOrCompute(self, compute: Callable[[], Tuple[np.ndarray]], *keyParts) -> Tuple[np.ndarray]:
+        arrays = self.load(*keyParts)
+        if arrays is None:
+            arrays = self.store(compute(), *keyParts)
+        return arrays
+
+    def evict(self, keep: str=None):
+        """
+        Remove the least recently used entries until the store is not larger than `maxBytes`.
+        """
+        entries = list()
+        for name in os.listdir(self.directory):
+            entryDir = os.path.join(self.directory, name)
+            if name.startswith(".tmp-") or not os.path.isdir(entryDir):
+                continue
+            size = sum(os.path.getsize(os.path.join(entryDir, file)) for file in os.listdir(entryDir))
+            entries.append((os.path.getmtime(entryDir), size, entryDir))
+        total = sum(entry[1] for entry in entries)
+        for mtime, size, entryDir in sorted(entries):
+            if total <= self.maxBytes:
+                break
+            if entryDir == keep:
+                continue
+            shutil.rmtree(entryDir, ignore_errors=True)
+            total -= size
+
+    def getGrid(self, bField: SPECField, kind: str, specFile: str=None) -> Tuple[np.ndarray]:
+        """
+        returns:
+            sArr, thetaArr, zetaArr, *components of `bField.getJacobian()`, `bField.getMetric()` or `bField.getB()`.
+        Args:
+            kind: should be `"jacobian"`, `"metric"` or `"B"`.
+            specFile: the SPEC output file of `bField.specData`, found from `specData` if it is not given.
+        """
+        methods = {"jacobian": bField.getJacobian, "metric": bField.getMetric, "B": bField.getB}
+        if kind not in methods:
+            raise ValueError(
+                "`kind` should be `jacobian`, `metric` or `B`. "
+            )
+        def compute():
+            value = methods[kind]()
+            components = value if isinstance(value, tuple) else (value, )
+            return (bField.sArr, bField.thetaArr, bField.zetaArr, *components)
+        return self.getOrCompute(
+            compute, kind, self.hashFile(self._specFile(bField, specFile)),
+            bField.lvol, len(bField.sArr), len(bField.thetaArr), len(bField.zetaArr)
+        )
+
+    def readJacobian(self, fileName: str) -> Tuple[np.ndarray]:
+        """
+        Cached `mpy.specMagneticField.readJacobian`.
+        """
+        return self.getOrCompute(lambda: readJacobian(fileName), "readJacobian", self.hashFile(fileName))
+
+    def readB(self, fileName: str) -> Tuple[np.ndarray]:
+        """
+        Cached `mpy.specMagneticField.readB`.
+        """
+        return self.getOrCompute(lambda: readB(fileName), "readB", self.hashFile(fileName))
+
+
+if __name__ == "__main__":
+    pass
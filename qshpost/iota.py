@@ -1,25 +1,65 @@
 import numpy as np
 from mpy.specMagneticField import FieldLine
 from .axis import Axis
+from typing import Tuple
 
 
-def getFirstIota(line: FieldLine) -> float:
-    iota = (line.thetaArr[-1]-line.thetaArr[0]) / (line.zetaArr[-1]-line.zetaArr[0])
-    return float(iota)
-
-
-def getSecondIota(line: FieldLine, axis: Axis) -> float:
-    
-    rAxis, zAxis = axis.getRZ(line.zetaArr)
-    rArr = line.rArr - rAxis
-    zArr = line.zArr - zAxis
-    positionVec = np.concatenate((rArr.reshape(-1,1),zArr.reshape(-1,1)), axis=1)
-    nums = len(positionVec)
-    normArr, cosAngle = list(), list()
-    for i in range(nums):
-        normArr.append(np.linalg.norm(positionVec[i]))
-    for i in range(nums-1):
-        cosAngle.append(np.dot(positionVec[i],positionVec[i+1])/normArr[i]/normArr[i+1])
-    thetaArr = np.cumsum(np.arccos(cosAngle))
-    iota = thetaArr[-1] / (line.zetaArr[-1]-line.zetaArr[0])
-    return float(iota)
+def getFirstIota(line: FieldLine, method: str="ratio", returnErr: bool=False) -> float or Tuple[float]:
+    """
+    Args:
+        method: `"ratio"`, the end-to-end winding ratio (the error falls as 1/N), or `"birkhoff"`, the weighted Birkhoff average
+            of the increments of theta (the error falls faster than any power of 1/N on regular surfaces).
+        returnErr: if `True`, the difference between the estimates from the first and the second half of the line is also returned.
+            It is small on regular surfaces and stays large on chaotic lines.
+    """
+    return _windingRate(np.diff(line.thetaArr), np.diff(line.zetaArr), method, returnErr)
+
+
+def getSecondIota(line: FieldLine, axis: Axis, method: str="ratio", returnErr: bool=False) -> float or Tuple[float]:
+    """
+    The rotation of (R, Z) about the second axis per zeta, the arguments are as `getFirstIota`.
+    """
+    angleArr = _axisAngleIncrements(line.rArr, line.zArr, line.zetaArr, axis)
+    return _windingRate(angleArr, np.diff(line.zetaArr), method, returnErr)
+
+
+def _axisAngleIncrements(rArr: np.ndarray, zArr: np.ndarray, zetaArr: np.ndarray, axis: Axis) -> np.ndarray:
+    # the angles between the successive positions relative to the axis
+    rAxis, zAxis = axis.getRZ(zetaArr)
+    positionVec = np.stack((rArr - rAxis, zArr - zAxis), axis=1)
+    normArr = np.linalg.norm(positionVec, axis=1)
+    cosAngle = np.einsum("ij,ij->i", positionVec[:-1], positionVec[1:]) / normArr[:-1] / normArr[1:]
+    # the rounding may leave |cos| slightly above 1
+    return np.arccos(np.clip(cosAngle, -1, 1))
+
+
+def _birkhoffWeights(nums: int) -> np.ndarray:
+    # the weights exp(-1/(t(1-t))) at t = (k+1)/(nums+1), normalized to sum 1
+    t = np.arange(1, nums+1) / (nums+1)
+    weight = np.exp(-1 / (t*(1-t)))
+    return weight / np.sum(weight)
+
+
+def _windingRate(angleArr: np.ndarray, zetaArr: np.ndarray, method: str, returnErr: bool) -> float or Tuple[float]:
+    # the rate of the angle increments `angleArr` over the zeta increments `zetaArr`
+    if method == "ratio":
+        def getRate(angle, zeta):
+            return np.sum(angle) / np.sum(zeta)
+    elif method == "birkhoff":
+        def getRate(angle, zeta):
+            weight = _birkhoffWeights(len(angle))
+            return np.sum(weight*angle) / np.sum(weight*zeta)
+    else:
+        raise ValueError(
+            "`method` should be `ratio` or `birkhoff`. "
+        )
+    iota = float(getRate(angleArr, zetaArr))
+    if not returnErr:
+        return iota
+    half = len(angleArr) // 2
+    err = float(abs(getRate(angleArr[:half], zetaArr[:half]) - getRate(angleArr[half:], zetaArr[half:])))
+    return iota, err
+
+
+if __name__ == "__main__":
+    pass
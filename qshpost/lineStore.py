@@ -0,0 +1,68 @@
+import h5py
+import numpy as np
+from mpy.specMagneticField import SPECField, FieldLine
+from ._tracing import iterLine
+from typing import List
+
+
+def traceToH5(
+    fileName: str, bField: SPECField,
+    s0: np.ndarray, theta0: np.ndarray, zeta0: np.ndarray,
+    resume: bool=True, **kwargs
+) -> List[int]:
+    """
+    Trace the field lines with `_tracing.iterLine` and append each finished line to the HDF5 file `fileName` at once.
+    The file keeps the initial points and one group `lines/<index>` per line with the chunked datasets `sArr`, `thetaArr`, `zetaArr`
+    and the attributes `nZeta`, `status`.
+    Args:
+        resume: if `True`, the lines already in the file are skipped, otherwise the file is overwritten.
+        kwargs: the arguments of `_tracing.traceLine`.
+    returns:
+        the indices of the lines traced in this call.
+    """
+    s0, theta0, zeta0 = np.atleast_1d(s0), np.atleast_1d(theta0), np.atleast_1d(zeta0)
+    traced = list()
+    with h5py.File(fileName, "a" if resume else "w") as f:
+        if "s0" in f:
+            if not (np.array_equal(f["s0"][:], s0) and np.array_equal(f["theta0"][:], theta0) and np.array_equal(f["zeta0"][:], zeta0)):
+                raise ValueError(
+                    "The initial points in " + fileName + " are different, please resume with the same initial points! "
+                )
+        else:
+            f.create_dataset("s0", data=s0)
+            f.create_dataset("theta0", data=theta0)
+            f.create_dataset("zeta0", data=zeta0)
+        lineGroup = f.require_group("lines")
+        for name in list(lineGroup.keys()):
+            if "status" not in lineGroup[name].attrs:       # interrupted while being written
+                del lineGroup[name]
+        done = [int(name) for name in lineGroup.keys()]
+        for index, line in iterLine(bField, s0, theta0, zeta0, skip=done, **kwargs):
+            group = lineGroup.create_group(str(index))
+            group.create_dataset("sArr", data=line.sArr, chunks=True)
+            group.create_dataset("thetaArr", data=line.thetaArr, chunks=True)
+            group.create_dataset("zetaArr", data=line.zetaArr, chunks=True)
+            group.attrs["nZeta"] = line.nZeta
+            group.attrs["status"] = getattr(line, "status", "finished")
+            f.flush()
+            traced.append(index)
+    return traced
+
+
+def readLinesH5(fileName: str, bField: SPECField) -> List[FieldLine]:
+    """
+    Read the lines written by `traceToH5`, the lines not traced yet are `None`.
+    """
+    with h5py.File(fileName, "r") as f:
+        lines = [None for _i in range(len(f["s0"]))]
+        for name, group in f["lines"].items():
+            if "status" not in group.attrs:
+                continue
+            line = FieldLine.getLine_tracing(bField, int(group.attrs["nZeta"]), group["sArr"][:], group["thetaArr"][:], group["zetaArr"][:])
+            line.status = str(group.attrs["status"])
+            lines[int(name)] = line
+    return lines
+
+
+if __name__ == "__main__":
+    pass
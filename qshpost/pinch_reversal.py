@@ -2,20 +2,58 @@ from mpy import SPECOut
 from mpy.specMagneticField import SPECField
 import numpy as np
 from scipy.integrate import quad
-from typing import Tuple
+from .gridCache import GridCache
+from ._integrate import periodicTrapezoid
+from ._parallel import parallelIter
+from typing import List, Tuple
 
 
-def getPinchReversalPara(spec_file: str, majorRadius: float, minorRadius: float, phiEdge: float) -> Tuple:
+def getPinchReversalPara(
+    spec_file: str, majorRadius: float, minorRadius: float, phiEdge: float, cache: GridCache=None,
+    method: str="trapezoid", tol: float=1e-10, nums: int=32, maxNums: int=4096
+) -> Tuple:
     """
     returns:
         pinch parameter, reversal parameter
+    Args:
+        cache: if given, the Jacobian grid is taken from this on-disk store instead of being recomputed. It is only used by `"quad"`,
+            and a `ValueError` is raised if it is given with `"trapezoid"`, which needs no grid.
+        method: `"trapezoid"` or `"quad"`. With `"trapezoid"`, the field and the Jacobian are only evaluated on the two boundary
+            curves: the Jacobian from the Fourier coefficients of the interfaces, and B^theta (along theta, zeta = 0) and
+            B^zeta (along zeta, theta = 0) in one call for both curves. The periodic integrals are the trapezoidal rule,
+            doubling the points from `nums` up to `maxNums` until converged to `tol`.
+            `"quad"` is the former adaptive quadrature with the Jacobian interpolated from a 128^3 grid.
     """
+    if method == "trapezoid" and cache is not None:
+        raise ValueError(
+            "`cache` should be `None` for the method `trapezoid`, which does not use the Jacobian grid. "
+        )
     speclib = SPECOut(spec_file)
-    outerField = SPECField(specData=speclib, lvol=1, sResolution=128, thetaResolution=128, zetaResolution=128)     
-    baseJacobian = outerField.getJacobian()
     deltaS = 1e-8
     from pyoculus.problems import SPECBfield
     pyoculusField = SPECBfield(speclib, 2)
+    if method == "trapezoid":
+        def getValue(angleArr):
+            thetaArr = np.concatenate((angleArr, np.zeros_like(angleArr)))
+            zetaArr = np.concatenate((np.zeros_like(angleArr), angleArr))
+            sArr = np.full(thetaArr.size, 1-deltaS)
+            field = pyoculusField.B_many(sArr, thetaArr, zetaArr) / _boundaryJacobian(speclib, 1, deltaS, thetaArr, zetaArr).reshape(-1,1)
+            return np.stack((field[0:angleArr.size, 1], field[angleArr.size:, 2]))
+        meanTheta, meanZeta = periodicTrapezoid(getValue, tol, nums, maxNums) / (2*np.pi)
+        return (
+            meanTheta / (phiEdge / (np.pi*minorRadius*minorRadius)),
+            meanZeta / (phiEdge / (np.pi*minorRadius*minorRadius))
+        )
+    elif method != "quad":
+        raise ValueError(
+            "`method` should be `trapezoid` or `quad`. "
+        )
+
+    outerField = SPECField(specData=speclib, lvol=1, sResolution=128, thetaResolution=128, zetaResolution=128)
+    if cache is None:
+        baseJacobian = outerField.getJacobian()
+    else:
+        baseJacobian = cache.getGrid(outerField, "jacobian", spec_file)[3]
     def getBoundaryB(theta, zeta):
         field = pyoculusField.B([1-deltaS, theta, zeta]) / outerField.interpValue(baseJacobian, 1-deltaS, theta, zeta)
         return field[0], field[1], field[2]
@@ -36,5 +74,68 @@ def getPinchReversalPara(spec_file: str, majorRadius: float, minorRadius: float,
     return pinchParameter, reversalParameter
 
 
+def getPinchReversalParaMany(
+    specFiles: List[str], majorRadius: float or np.ndarray, minorRadius: float or np.ndarray, phiEdge: float or np.ndarray,
+    workers: int=None, **kwargs
+) -> Tuple[np.ndarray]:
+    """
+    `getPinchReversalPara` of many equilibria, by `workers` processes if given.
+    Args:
+        majorRadius, minorRadius, phiEdge: the same for all the files, or one for each file.
+        kwargs: the options of `getPinchReversalPara`.
+    returns:
+        pinch parameters, reversal parameters: the arrays in the order of `specFiles`, `nan` for the files which fail.
+    """
+    nums = len(specFiles)
+    taskList = [
+        {
+            "spec_file": specFiles[i], "majorRadius": np.broadcast_to(majorRadius, nums)[i],
+            "minorRadius": np.broadcast_to(minorRadius, nums)[i], "phiEdge": np.broadcast_to(phiEdge, nums)[i]
+        }
+        for i in range(nums)
+    ]
+    if workers is not None and workers > 1:
+        results = parallelIter(_pinchReversalTask, taskList, workers, **kwargs)
+    else:
+        results = (_pinchReversalTask(**task, **kwargs) for task in taskList)
+    pinchArr, reversalArr = np.full(nums, np.nan), np.full(nums, np.nan)
+    for i, result in enumerate(results):
+        if isinstance(result, str):
+            print("Cannot compute the case " + specFiles[i] + ": " + result)
+            continue
+        pinchArr[i], reversalArr[i] = result
+    return pinchArr, reversalArr
+
+
+def _pinchReversalTask(**kwargs) -> Tuple[float] or str:
+    try:
+        return getPinchReversalPara(**kwargs)
+    except Exception as error:
+        return repr(error)
+
+
+def _boundaryJacobian(specData: SPECOut, lvol: int, deltaS: float, thetaArr: np.ndarray, zetaArr: np.ndarray) -> np.ndarray:
+    # the Jacobian R (Z_s R_theta - R_s Z_theta) at s = 1-deltaS of the volume `lvol` (counted from 0, not the innermost one),
+    # where R and Z are linear in s between the interfaces `lvol` and `lvol+1`
+    output = specData.output
+    im, xn = np.asarray(output.im).flatten(), np.asarray(output.in_).flatten()
+    weight = (2-deltaS) / 2
+    coeff = dict()
+    for name in ("Rbc", "Rbs", "Zbc", "Zbs"):
+        value = getattr(output, name, None)
+        if value is None:
+            value = np.zeros_like(output.Rbc)
+        value = np.asarray(value)
+        coeff[name] = (value[lvol] + weight*(value[lvol+1]-value[lvol]), (value[lvol+1]-value[lvol]) / 2)
+    angle = np.outer(thetaArr, im) - np.outer(zetaArr, xn)
+    cosArr, sinArr = np.cos(angle), np.sin(angle)
+    rValue = cosArr @ coeff["Rbc"][0] + sinArr @ coeff["Rbs"][0]
+    rS = cosArr @ coeff["Rbc"][1] + sinArr @ coeff["Rbs"][1]
+    zS = sinArr @ coeff["Zbs"][1] + cosArr @ coeff["Zbc"][1]
+    rTheta = - sinArr @ (im*coeff["Rbc"][0]) + cosArr @ (im*coeff["Rbs"][0])
+    zTheta = cosArr @ (im*coeff["Zbs"][0]) - sinArr @ (im*coeff["Zbc"][0])
+    return rValue * (zS*rTheta - rS*zTheta)
+
+
 if __name__ == "__main__":
     pass
@@ -0,0 +1,246 @@
+import h5py
+import numpy as np
+from scipy.interpolate import RectBivariateSpline
+from mpy.specMagneticField import SPECField
+from mpy.misc import print_progress
+from .gridCache import GridCache
+from ._tracing import iterLine, getGridData
+from typing import Tuple
+
+
+class ReturnMap:
+    r"""
+    The map of one field period (s, \theta) -> (s', \theta') on the section zeta = zeta0, tabulated on a tensor grid over a region
+    and interpolated by bicubic splines, so long Poincare iterations are done in vectorized NumPy instead of tracing.
+    The displacements s' - s and \theta' - \theta are interpolated, which are smooth and periodic in \theta.
+    """
+
+    def __init__(
+        self, sArr: np.ndarray, thetaArr: np.ndarray, dS: np.ndarray, dTheta: np.ndarray,
+        zeta0: float=0.0, periodic: bool=True, error: float=np.nan
+    ) -> None:
+        """
+        Args:
+            sArr, thetaArr: the nodes, with `thetaArr` in [theta_0, theta_0 + 2*pi) if `periodic`.
+            dS, dTheta: the displacements on the nodes, with the shape (len(sArr), len(thetaArr)).
+            periodic: if `True`, the region covers all theta, otherwise it is the box of the nodes.
+            error: the estimate of the interpolation error from the tabulation.
+        """
+        self.sArr = np.asarray(sArr, dtype=float)
+        self.thetaArr = np.asarray(thetaArr, dtype=float)
+        self.dS = np.asarray(dS, dtype=float)
+        self.dTheta = np.asarray(dTheta, dtype=float)
+        self.zeta0 = float(zeta0)
+        self.periodic = bool(periodic)
+        self.error = float(error)
+        self._splineS, self._splineTheta = self._getSplines(self.sArr, self.thetaArr, self.dS, self.dTheta, self.periodic)
+
+    @staticmethod
+    def _getSplines(sArr: np.ndarray, thetaArr: np.ndarray, dS: np.ndarray, dTheta: np.ndarray, periodic: bool) -> Tuple[RectBivariateSpline]:
+        if periodic:
+            # three nodes of the neighbouring periods on each side, so the spline is periodic to the rounding in one period
+            thetaArr = np.concatenate((thetaArr[-3:]-2*np.pi, thetaArr, thetaArr[:3]+2*np.pi))
+            dS = np.concatenate((dS[:, -3:], dS, dS[:, :3]), axis=1)
+            dTheta = np.concatenate((dTheta[:, -3:], dTheta, dTheta[:, :3]), axis=1)
+        return RectBivariateSpline(sArr, thetaArr, dS, kx=3, ky=3), RectBivariateSpline(sArr, thetaArr, dTheta, kx=3, ky=3)
+
+    def _inside(self, sValue: np.ndarray, thetaValue: np.ndarray) -> np.ndarray:
+        inside = (sValue >= self.sArr[0]) & (sValue <= self.sArr[-1])
+        if not self.periodic:
+            inside &= (thetaValue >= self.thetaArr[0]) & (thetaValue <= self.thetaArr[-1])
+        return inside
+
+    def __call__(self, sValue: np.ndarray, thetaValue: np.ndarray) -> Tuple[np.ndarray]:
+        """
+        One application of the map. Points outside the region are mapped to `nan`.
+        """
+        sValue, thetaValue = np.broadcast_arrays(np.asarray(sValue, dtype=float), np.asarray(thetaValue, dtype=float))
+        newS, newTheta = np.full(sValue.shape, np.nan), np.full(sValue.shape, np.nan)
+        inside = self._inside(sValue, thetaValue)
+        s, theta = sValue[inside], thetaValue[inside]
+        angle = self.thetaArr[0] + (theta - self.thetaArr[0]) % (2*np.pi) if self.periodic else theta
+        newS[inside] = s + self._splineS.ev(s, angle)
+        newTheta[inside] = theta + self._splineTheta.ev(s, angle)
+        return newS, newTheta
+
+    def iterate(self, s0: np.ndarray, theta0: np.ndarray, niter: int) -> Tuple[np.ndarray]:
+        """
+        Iterate the map `niter` times from all the points at once. A point which leaves the region stays `nan`.
+        returns:
+            sArr, thetaArr: the orbits with the shape (niter+1, nums), theta is not reduced modulo 2*pi.
+        """
+        s0, theta0 = np.atleast_1d(np.asarray(s0, dtype=float)), np.atleast_1d(np.asarray(theta0, dtype=float))
+        sArr, thetaArr = np.empty((niter+1, s0.size)), np.empty((niter+1, s0.size))
+        sArr[0], thetaArr[0] = s0, theta0
+        for k in range(niter):
+            sArr[k+1], thetaArr[k+1] = self(sArr[k], thetaArr[k])
+        return sArr, thetaArr
+
+    def checkError(
+        self, bField: SPECField, nSample: int=64, niter: int=1, seed: int=0, nstep: int=32,
+        bMethod: str="calculate", **kwargs
+    ) -> Tuple[float]:
+        """
+        Compare the interpolated map with the tracing at `nSample` random points of the region.
+        Beyond the first periods the difference also contains the divergence of the nearby orbits, which is large in chaotic regions.
+        Args:
+            niter: number of periods compared.
+            kwargs: the options of `traceLine`, which should be those of the tabulation, without `batch` and `sectionOnly`.
+        returns:
+            maxErr, rmsErr: of max(|s_map - s_trace|, |theta_map - theta_trace|) over the points (which stay in the region) and periods.
+        """
+        _checkTraceOptions(kwargs)
+        rng = np.random.default_rng(seed)
+        s0 = rng.uniform(self.sArr[0], self.sArr[-1], nSample)
+        theta0 = rng.uniform(self.thetaArr[0], self.thetaArr[0]+2*np.pi if self.periodic else self.thetaArr[-1], nSample)
+        sTrace, thetaTrace = _traceSection(bField, s0, theta0, self.zeta0, niter, nstep, bMethod, printControl=False, **kwargs)
+        sMap, thetaMap = self.iterate(s0, theta0, niter)
+        err = np.maximum(np.abs(sMap - sTrace), np.abs(thetaMap - thetaTrace))[1:]
+        err = err[np.isfinite(err)]
+        return float(np.max(err)), float(np.sqrt(np.mean(err*err)))
+
+    @classmethod
+    def tabulate(
+        cls, bField: SPECField, sRange: Tuple[float], thetaRange: Tuple[float]=None, zeta0: float=0.0,
+        nS: int=17, nTheta: int=32, tol: float=1e-6, maxLevel: int=4, nstep: int=32,
+        bMethod: str="calculate", bData: str=None, jacobianData: str=None, cache: GridCache=None, specFile: str=None,
+        workers: int=None, printControl: bool=True, **kwargs
+    ):
+        """
+        Tabulate the map on a grid which starts from `nS` x `nTheta` nodes and is refined where it is needed. In each level,
+        the lines from the midpoints of all the intervals (at the nodes of the other direction) are traced and compared with
+        the interpolation, and the intervals whose error is larger than `tol` are split at their midpoints, so the checked
+        points become nodes. The refinement stops when no interval is split or after `maxLevel` levels.
+        Args:
+            sRange: (sMin, sMax) of the region.
+            thetaRange: (thetaMin, thetaMax) of the region, all theta (periodic) if it is `None`.
+            tol: the target of max(|ds|, |dtheta|) of the interpolation.
+            workers: number of processes of the tracing, as in `traceLine`.
+            cache: if given, the table is kept in this on-disk store, keyed by the content of the SPEC file and the arguments,
+                and the grids of the field are taken from it as well.
+            kwargs: the options of `traceLine`, such as `method` and `rtol`. The lines are always traced with `batch=True` 
+                and `sectionOnly=True`, so these two are not accepted. 
+        returns:
+            the map, whose `error` is the largest error found in the last level (`nan` if the grid is not checked).
+        """
+        _checkTraceOptions(kwargs)
+        periodic = thetaRange is None
+        gridData = getGridData(bField, bMethod, bData, jacobianData, cache, specFile)
+
+        def traceMap(sValue, thetaValue):
+            sTrace, thetaTrace = _traceSection(
+                bField, sValue.ravel(), thetaValue.ravel(), zeta0, 1, nstep, bMethod, gridData=gridData, workers=workers,
+                printControl=False, **kwargs
+            )
+            return (sTrace[1] - sValue.ravel()).reshape(sValue.shape), (thetaTrace[1] - thetaValue.ravel()).reshape(sValue.shape)
+
+        def compute():
+            sArr = np.linspace(sRange[0], sRange[1], nS)
+            if periodic:
+                thetaArr = 2 * np.pi * np.arange(nTheta) / nTheta
+            else:
+                thetaArr = np.linspace(thetaRange[0], thetaRange[1], nTheta)
+            dS, dTheta = traceMap(*np.meshgrid(sArr, thetaArr, indexing="ij"))
+            if np.any(np.isnan(dS)):
+                raise ValueError(
+                    "Some lines from the region leave the volume in one period, please choose a smaller `sRange`. "
+                )
+            error = np.nan
+            for level in range(maxLevel):
+                if printControl:
+                    print_progress(level+1, maxLevel)
+                returnMap = cls(sArr, thetaArr, dS, dTheta, zeta0, periodic)
+                sMid = (sArr[:-1] + sArr[1:]) / 2
+                thetaNext = np.append(thetaArr[1:], thetaArr[0]+2*np.pi) if periodic else thetaArr[1:]
+                thetaMid = (thetaArr[:len(thetaNext)] + thetaNext) / 2
+                # the errors at the midpoints in s (on the theta nodes) and in theta (on the s nodes)
+                sMidValue = traceMap(*np.meshgrid(sMid, thetaArr, indexing="ij"))
+                thetaMidValue = traceMap(*np.meshgrid(sArr, thetaMid, indexing="ij"))
+                sErr = _mapError(returnMap, *np.meshgrid(sMid, thetaArr, indexing="ij"), *sMidValue)
+                thetaErr = _mapError(returnMap, *np.meshgrid(sArr, thetaMid, indexing="ij"), *thetaMidValue)
+                error = max(np.max(sErr), np.max(thetaErr))
+                sSplit = np.max(sErr, axis=1) > tol
+                thetaSplit = np.max(thetaErr, axis=0) > tol
+                if not np.any(sSplit) and not np.any(thetaSplit):
+                    break
+                # the new rows and columns are the checked points, only their crossings are traced
+                crossValue = traceMap(*np.meshgrid(sMid[sSplit], thetaMid[thetaSplit], indexing="ij"))
+                newS = np.concatenate((sArr, sMid[sSplit]))
+                newTheta = np.concatenate((thetaArr, thetaMid[thetaSplit]))
+                newTable = list()
+                for old, sValue, thetaValue, cross in zip((dS, dTheta), sMidValue, thetaMidValue, crossValue):
+                    top = np.concatenate((old, thetaValue[:, thetaSplit]), axis=1)
+                    bottom = np.concatenate((sValue[sSplit], cross), axis=1)
+                    newTable.append(np.concatenate((top, bottom), axis=0))
+                sOrder, thetaOrder = np.argsort(newS), np.argsort(newTheta)
+                sArr, thetaArr = newS[sOrder], newTheta[thetaOrder]
+                dS, dTheta = (table[sOrder][:, thetaOrder] for table in newTable)
+            return sArr, thetaArr, dS, dTheta, np.array(error)
+
+        if cache is None:
+            sArr, thetaArr, dS, dTheta, error = compute()
+        else:
+            sArr, thetaArr, dS, dTheta, error = cache.getOrCompute(
+                compute, "returnMap", cache.hashFile(cache._specFile(bField, specFile)), bField.lvol,
+                len(bField.sArr), len(bField.thetaArr), len(bField.zetaArr), bMethod, tuple(sRange),
+                None if periodic else tuple(thetaRange), zeta0, nS, nTheta, tol, maxLevel, nstep, repr(sorted(kwargs.items()))
+            )
+        returnMap = cls(sArr, thetaArr, dS, dTheta, zeta0, periodic, float(error))
+        if printControl:
+            print("The return map is tabulated on " + str(len(sArr)) + " x " + str(len(thetaArr)) + " nodes, the error is about " + "{:.2e}".format(returnMap.error) + " ...")
+        return returnMap
+
+    @classmethod
+    def readH5(cls, fileName: str):
+        with h5py.File(fileName, 'r') as f:
+            sArr = f["sArr"][:]
+            thetaArr = f["thetaArr"][:]
+            dS = f["dS"][:]
+            dTheta = f["dTheta"][:]
+            zeta0 = f["zeta0"][()]
+            periodic = f["periodic"][()]
+            error = f["error"][()]
+        return cls(sArr=sArr, thetaArr=thetaArr, dS=dS, dTheta=dTheta, zeta0=zeta0, periodic=periodic, error=error)
+
+    def writeH5(self, fileName: str):
+        with h5py.File(fileName, 'w') as f:
+            f.create_dataset("sArr", data=self.sArr)
+            f.create_dataset("thetaArr", data=self.thetaArr)
+            f.create_dataset("dS", data=self.dS)
+            f.create_dataset("dTheta", data=self.dTheta)
+            f.create_dataset("zeta0", data=self.zeta0)
+            f.create_dataset("periodic", data=self.periodic)
+            f.create_dataset("error", data=self.error)
+
+
+def _mapError(returnMap: ReturnMap, sValue: np.ndarray, thetaValue: np.ndarray, dS: np.ndarray, dTheta: np.ndarray) -> np.ndarray:
+    newS, newTheta = returnMap(sValue, thetaValue)
+    return np.maximum(np.abs(newS - sValue - dS), np.abs(newTheta - thetaValue - dTheta))
+
+
+def _checkTraceOptions(kwargs: dict):
+    # `_traceSection` sets these options of `traceLine` itself
+    for name in ("batch", "sectionOnly"):
+        if name in kwargs:
+            raise ValueError(
+                "`" + name + "` should not be given, the return map always traces the lines with `batch=True` and `sectionOnly=True`. "
+            )
+
+
+def _traceSection(
+    bField: SPECField, s0: np.ndarray, theta0: np.ndarray, zeta0: float, niter: int, nstep: int, bMethod: str, **kwargs
+) -> Tuple[np.ndarray]:
+    # the section crossings of the lines, with the shape (niter+1, nums), nan after a line leaves the volume
+    sArr, thetaArr = np.full((niter+1, s0.size), np.nan), np.full((niter+1, s0.size), np.nan)
+    for index, line in iterLine(
+        bField, s0, theta0, np.full(s0.size, float(zeta0)), niter=niter, nstep=nstep, bMethod=bMethod,
+        batch=True, sectionOnly=True, **kwargs
+    ):
+        sArr[:len(line.sArr), index], thetaArr[:len(line.thetaArr), index] = line.sArr, line.thetaArr
+    sArr[np.abs(sArr) > 1] = np.nan
+    thetaArr[np.isnan(sArr)] = np.nan
+    return sArr, thetaArr
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import mpy
+import numpy as np
+from mpy.specMagneticField import SPECField
+from .axis import Axis
+from .bifurcation import findBifurcation
+from .fixedPoint import findAxes
+from .gridCache import GridCache
+from .successCase import SuccessCase
+from ._tracing import traceLine
+from ._parallel import parallelIter
+from typing import Callable, Iterator, List, Tuple
+
+
+_COLUMNS = ("case", "firstR", "secondR", "leftS", "rightS")
+
+
+def _caseList(success: SuccessCase or List[str] or str) -> List[str]:
+    if isinstance(success, SuccessCase):
+        return list(success.name)
+    if isinstance(success, str):
+        # the success list written by `checkLog`, the names are completed as in `SuccessCase.readSuccessTxt`
+        with open(success, 'r') as f:
+            return [file.strip("\n") + ".h5" for file in f if file.strip("\n") != ""]
+    return list(success)
+
+
+def _caseKey(fileName: str, params: dict) -> str:
+    return hashlib.sha256((GridCache.hashFile(fileName) + repr(sorted(params.items()))).encode()).hexdigest()[0:32]
+
+
+def scanCase(
+    fileName: str, secondPoint: Tuple[float] or Callable, ntor: int,
+    lvol: int=0, resolution: int=64, axisTurns: int=1, niter: int=10, iterLine: int=6,
+    gridCache: GridCache=None, axisMethod: str="trace", **kwargs
+) -> dict:
+    """
+    The axes and the bifurcation search of one equilibrium.
+    Args:
+        fileName: the SPEC output (.h5) file.
+        secondPoint: (s, theta) on the section zeta = 0 of the second axis in the volume `lvol`,
+            or a function `secondPoint(specData)` returning it.
+        ntor: number of toroidal harmonics of the axes.
+        resolution: the (s, theta, zeta) resolution of the field grids.
+        axisTurns: number of toroidal turns of the line traced from `secondPoint` to fit the second axis.
+        axisMethod: `"trace"`, the first axis from the SPEC output and the second one fitted to the line traced from `secondPoint`, 
+            or `"newton"`, both axes as the fixed points of the field-period map by `findAxes`, starting from the coordinate axis 
+            and from `secondPoint`. 
+        kwargs: the options of `findBifurcation`.
+    returns:
+        a dict with the keys "case", "firstR", "secondR", "leftS", "rightS", and the two axes under "firstAxis" and "secondAxis".
+    """
+    specData = mpy.SPECOut(fileName)
+    bField = SPECField(specData=specData, lvol=lvol, sResolution=resolution, thetaResolution=resolution, zetaResolution=resolution)
+    s0, theta0 = secondPoint(specData) if callable(secondPoint) else secondPoint
+    if axisMethod == "trace":
+        firstAxis = Axis.readSPECOut(ntor, specData)
+        line = traceLine(bField, s0, theta0, 0.0, niter=bField.nfp*axisTurns, nstep=32, printControl=False, cache=gridCache, specFile=fileName)[0]
+        secondAxis = Axis.traceLine(ntor, line, specData)
+    elif axisMethod == "newton":
+        firstAxis, secondAxis = findAxes(bField, ntor, (s0, theta0), printControl=False, cache=gridCache, specFile=fileName)
+    else:
+        raise ValueError(
+            "`axisMethod` should be `trace` or `newton`. "
+        )
+    leftS, rightS = findBifurcation(
+        firstAxis, secondAxis, bField, None, niter=niter, iterLine=iterLine, cache=gridCache, specFile=fileName, **kwargs
+    )
+    return {
+        "case": fileName,
+        "firstR": float(firstAxis.getRZ(np.array([0]))[0][0]),
+        "secondR": float(secondAxis.getRZ(np.array([0]))[0][0]),
+        "leftS": float(leftS), "rightS": float(rightS),
+        "firstAxis": firstAxis, "secondAxis": secondAxis
+    }
+
+
+def _scanTask(fileName: str, **kwargs) -> Tuple[str, dict or str]:
+    try:
+        return fileName, scanCase(fileName, **kwargs)
+    except Exception as error:
+        return fileName, repr(error)
+
+
+def iterScan(
+    success: SuccessCase or List[str] or str, secondPoint: Tuple[float] or Callable, ntor: int,
+    cacheDir: str="scanCache", workers: int=None, **kwargs
+) -> Iterator[dict]:
+    """
+    Run `scanCase` for every case of a success list and yield the rows (without the axes) as soon as they are available:
+    first the cases finished in an earlier run, then the new ones in the order of completion.
+    Each finished case is kept in `cacheDir` (`<key>.json` and the axes in `<key>_first.h5`, `<key>_second.h5`), keyed by the content
+    of the SPEC file and the parameters, so a rerun skips it. A failed case is reported and not cached, so a rerun tries it again.
+    Args:
+        success: a `SuccessCase`, a list of SPEC output files, or the success list written by `checkLog`.
+        workers: number of processes, the cases are traced serially if it is `None`.
+        kwargs: the options of `scanCase` and `findBifurcation`.
+    """
+    os.makedirs(cacheDir, exist_ok=True)
+    params = dict(kwargs, ntor=ntor, secondPoint=getattr(secondPoint, "__qualname__", secondPoint))
+    params.pop("gridCache", None)
+    params.pop("workers", None)
+    pending = list()
+    for fileName in _caseList(success):
+        jsonFile = os.path.join(cacheDir, _caseKey(fileName, params) + ".json")
+        if os.path.isfile(jsonFile):
+            with open(jsonFile, 'r') as f:
+                row = json.load(f)
+            # the key does not depend on the path, so the row may be written under another path of the same file
+            row["case"] = fileName
+            yield row
+        else:
+            pending.append(fileName)
+    if workers is not None and workers > 1:
+        results = parallelIter(
+            _scanTask, [{"fileName": fileName} for fileName in pending], workers, ordered=False,
+            secondPoint=secondPoint, ntor=ntor, **kwargs
+        )
+    else:
+        results = (_scanTask(fileName, secondPoint=secondPoint, ntor=ntor, **kwargs) for fileName in pending)
+    for fileName, result in results:
+        if isinstance(result, str):
+            print("Cannot scan the case " + fileName + ": " + result)
+            continue
+        key = os.path.join(cacheDir, _caseKey(fileName, params))
+        result.pop("firstAxis").writeH5(key + "_first.h5")
+        result.pop("secondAxis").writeH5(key + "_second.h5")
+        with open(key + ".json.tmp", 'w') as f:
+            json.dump(result, f)
+        os.replace(key + ".json.tmp", key + ".json")
+        yield result
+
+
+def scanBifurcation(
+    success: SuccessCase or List[str] or str, secondPoint: Tuple[float] or Callable, ntor: int,
+    tableFile: str="bifurcation.csv", cacheDir: str="scanCache", workers: int=None, **kwargs
+) -> List[dict]:
+    """
+    Run `iterScan` and write the table `tableFile` with the columns case, firstR, secondR, leftS, rightS.
+    The rows are appended to the table as they come, and the table is sorted in the order of the success list at the end.
+    returns:
+        the rows in the order of the success list.
+    """
+    rows = list()
+    with open(tableFile, 'w') as f:
+        f.write(",".join(_COLUMNS) + "\n")
+        for row in iterScan(success, secondPoint, ntor, cacheDir=cacheDir, workers=workers, **kwargs):
+            rows.append(row)
+            f.write(",".join(str(row[column]) for column in _COLUMNS) + "\n")
+            f.flush()
+    order = {fileName: index for index, fileName in enumerate(_caseList(success))}
+    rows.sort(key=lambda row: order[row["case"]])
+    with open(tableFile, 'w') as f:
+        f.write(",".join(_COLUMNS) + "\n")
+        for row in rows:
+            f.write(",".join(str(row[column]) for column in _COLUMNS) + "\n")
+    return rows
+
+
+if __name__ == "__main__":
+    pass
@@ -1,8 +1,18 @@
+import time
 import numpy as np
-from scipy.integrate import solve_ivp 
 from mpy.specMagneticField import SPECField, FieldLine
 from mpy.misc import print_progress
-from typing import List
+from ._interpolate import GridInterpolator
+from ._integrate import restartSamples, continuousSamples, instrumentFun, TracingStats, IntegrationError
+from ._parallel import parallelMap, splitIndex
+from .gridCache import GridCache
+from typing import Callable, List
+
+
+# the 6 independent components g_ij (i <= j) of the symmetric metric, and their weights in B^i B^j g_ij
+_METRIC_I = np.array([0, 0, 0, 1, 1, 2])
+_METRIC_J = np.array([0, 1, 2, 1, 2, 2])
+_METRIC_WEIGHT = np.array([1.0, 2.0, 2.0, 1.0, 2.0, 1.0])
 
 
 def traceLine(
@@ -11,7 +21,8 @@ def traceLine(
     oneLength: float, 
     niter: int=128, nstep: int=32, 
     sResolution: int=128, thetaResolution: int=128, zetaResolution: int=128, 
-    **kwargs
+    workers: int=None, continuous: bool=False, batch: bool=False, 
+    cache: GridCache=None, specFile: str=None, instrument: bool or Callable=False, **kwargs
 ) -> List[FieldLine]:
     r"""
     Working in SPEC coordintes (s, \theta, \zeta), compute magnetic field lines by solving
@@ -25,6 +36,19 @@ def traceLine(
         zeta0: list of zeta components of initial points. 
         niter: Number of toroidal periods. 
         nstep: Number of intermediate step for one period
+        workers: number of processes, the initial points are split into contiguous chunks and traced in a process pool. 
+            The field, the Jacobian and the metric are inherited (or pickled once) by each worker. 
+        continuous: if `True`, each line is integrated by one stepper and sampled at the same length grid from its dense output, 
+            instead of restarting `solve_ivp` on every interval. 
+        batch: if `True`, all the lines are advanced together as one system, the state is `[s_1, theta_1, zeta_1, s_2, ...]` 
+            and the field is evaluated for all lines in one call. Lines which have left the volume (|s| > 1) are frozen. 
+        cache: if given, the Jacobian and the metric are taken from this on-disk store instead of being recomputed. 
+        specFile: the SPEC output file of the field, used as the cache key when `bField.specData` does not know it. 
+        instrument: if `True`, each line gets a `stats` attribute (`TracingStats`), shared by all lines with `batch=True`. 
+            If it is callable, it is also called as `instrument(index, stats)` for each line. 
+    returns:
+        the lines, each with a `status` attribute: `"finished"`, or `"failed"` if a step of the solver failed (for all the lines 
+        of its group); a failed line is truncated at its last point, and the other lines are traced on. 
     """
 
     if isinstance(s0, float):
@@ -39,43 +63,106 @@ def traceLine(
     print("Change the resolution of the field... ")
     bField.changeResolution(sResolution=sResolution, thetaResolution=thetaResolution, zetaResolution=zetaResolution)
     print("Get the Jacobian and metric of the field... ")
-    baseJacobian = bField.getJacobian()
-    baseMetric = bField.getMetric()
+    if cache is None:
+        baseJacobian = bField.getJacobian()
+        baseMetric = bField.getMetric()
+    else:
+        baseJacobian = cache.getGrid(bField, "jacobian", specFile)[3]
+        baseMetric = cache.getGrid(bField, "metric", specFile)[3]
+    # the Jacobian and the independent metric components are interpolated together
+    interpolator = GridInterpolator(
+        bField.sArr, bField.thetaArr, bField.zetaArr, 
+        baseJacobian, *[baseMetric[..., i, j] for i, j in zip(_METRIC_I, _METRIC_J)], 
+        nfp=bField.nfp
+    )
+    del baseJacobian, baseMetric
+
+    if workers is not None and workers > 1:
+        print("Begin field line tracing with " + str(workers) + " workers... ")
+        chunks = splitIndex(len(s0), workers)
+        taskList = [{"s0": s0[chunk], "theta0": theta0[chunk], "zeta0": zeta0[chunk]} for chunk in chunks]
+        results = parallelMap(
+            _traceLines, taskList, workers, 
+            bField=bField, interpolator=interpolator, 
+            oneLength=oneLength, niter=niter, nstep=nstep, printControl=False, continuous=continuous, batch=batch, 
+            instrument=bool(instrument), **kwargs
+        )
+        lines = [line for lines in results for line in lines]
+    else:
+        lines = _traceLines(bField, interpolator, s0, theta0, zeta0, oneLength, niter, nstep, continuous=continuous, batch=batch, instrument=bool(instrument), **kwargs)
+    if callable(instrument):
+        for index, line in enumerate(lines):
+            instrument(index, line.stats)
+    return lines
+
+
+def _traceLines(
+    bField: SPECField, interpolator: GridInterpolator, 
+    s0: np.ndarray, theta0: np.ndarray, zeta0: np.ndarray, 
+    oneLength: float, niter: int, nstep: int, printControl: bool=True, continuous: bool=False, batch: bool=False, 
+    instrument: bool=False, **kwargs
+) -> List[FieldLine]:
 
     from pyoculus.problems import SPECBfield
     pyoculusField = SPECBfield(bField.specData, bField.lvol+1)
-    def getB(dLength, point):
-        field = pyoculusField.B([point[0], point[1], point[2]]) / bField.interpValue(baseJacobian, point[0], point[1], point[2])
-        metric = bField.interpValue(baseMetric, point[0], point[1], point[2])
-        # bSupS = field[0]
-        # bSupTheta = field[1]
-        # bSupZeta = field[2]
-        bPow = 0
-        for i in range(3):
-            for j in range(3): 
-                bPow += (field[i]*field[j]*metric[0,i,j]) 
-        b = np.power(bPow, 0.5)
-        return [field[0]/b, field[1]/b, field[2]/b]
+    def getB(dLength, state):
+        point = state.reshape(-1, 3)
+        dState = np.zeros_like(point)
+        inside = np.abs(point[:,0]) <= 1            # freeze the field lines which have left the volume
+        if not np.any(inside):
+            return dState.flatten()
+        sValue, thetaValue, zetaValue = point[inside, 0], point[inside, 1], point[inside, 2]
+        jacobianMetric = interpolator(sValue, thetaValue, zetaValue)
+        field = pyoculusField.B_many(sValue, thetaValue, zetaValue) / jacobianMetric[:, 0:1]
+        # B^2 = B^i B^j g_ij, contracted over the independent components
+        bPow = np.einsum("nk,nk,nk,k->n", field[:, _METRIC_I], field[:, _METRIC_J], jacobianMetric[:, 1:], _METRIC_WEIGHT)
+        dState[inside] = field / np.sqrt(bPow)[:, np.newaxis]
+        return dState.flatten()
+
+    if batch:
+        groups = [np.arange(len(s0))]
+        if kwargs["method"] == "LSODA" and kwargs.get("lband") is None and kwargs.get("uband") is None:
+            # each line only couples its own (s, theta, zeta), so the Jacobian is banded
+            kwargs.update({"lband": 2, "uband": 2})
+    else:
+        groups = [np.array([i]) for i in range(len(s0))]
 
-    print("Begin field line tracing: ")
+    if printControl:
+        print("Begin field line tracing: ")
     lines = list()
-    for lineIndex in range(len(s0)):           # loop over each field line
-        point = [s0[lineIndex], theta0[lineIndex], zeta0[lineIndex]]
-        initLength = 0
-        deltaLength = oneLength / nstep
-        sArr = [s0[lineIndex]]
-        thetaArr = [theta0[lineIndex]]
-        zetaArr = [zeta0[lineIndex]]
-        for j in range(niter):              # loop over each toroidal iteration
-            print_progress(lineIndex*niter+j+1, len(s0)*niter)
-            for k in range(nstep):          # loop inside one iteration
-                sol = solve_ivp(getB, (initLength, initLength+deltaLength), point, **kwargs)            # solve ODEs
-                sArr.append(sol.y[0,-1])
-                thetaArr.append(sol.y[1,-1])
-                zetaArr.append(sol.y[2,-1])
-                point = [sArr[-1], thetaArr[-1], zetaArr[-1]]
-                initLength += deltaLength
-        lines.append(FieldLine.getLine_tracing(bField, nstep, np.array(sArr), np.array(thetaArr), np.array(zetaArr)))
+    deltaLength = oneLength / nstep
+    for i, group in enumerate(groups):          # loop over each group of field lines
+        point = np.stack((s0[group], theta0[group], zeta0[group]), axis=1).flatten()
+        sArr = np.empty((niter*nstep+1, len(group)))
+        thetaArr = np.empty((niter*nstep+1, len(group)))
+        zetaArr = np.empty((niter*nstep+1, len(group)))
+        sArr[0], thetaArr[0], zetaArr[0] = point[0::3], point[1::3], point[2::3]
+        startTime = time.perf_counter()
+        stats = TracingStats() if instrument else None
+        fun = getB if stats is None else instrumentFun(getB, stats, 3)
+        if continuous:
+            samples = continuousSamples(fun, 0, deltaLength, niter*nstep, point, stats=stats, **kwargs)
+        else:
+            samples = restartSamples(fun, 0, deltaLength, niter*nstep, point, stats=stats, **kwargs)
+        kDone, status = 0, "finished"
+        try:
+            for k, (length, point) in enumerate(samples, start=1):
+                if printControl and (k-1) % nstep == 0:
+                    print_progress(i*niter+(k-1)//nstep+1, len(groups)*niter)
+                sArr[k], thetaArr[k], zetaArr[k] = point[0::3], point[1::3], point[2::3]
+                kDone = k
+        except IntegrationError as error:
+            # the lines of this group stop at their last point, the other groups are traced on
+            status = "failed"
+            if printControl:
+                print("The lines " + str([int(j) for j in group]) + " are stopped: " + str(error))
+        if stats is not None:
+            stats.totalTime = time.perf_counter() - startTime
+        for index in range(len(group)):
+            lines.append(FieldLine.getLine_tracing(bField, nstep, sArr[:kDone+1,index], thetaArr[:kDone+1,index], zetaArr[:kDone+1,index]))
+            lines[-1].status = status
+            if stats is not None:
+                lines[-1].stats = stats
     return lines
 
 